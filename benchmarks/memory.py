@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Memory benchmark for MyOrganizer.
+
+Generates synthetic folders in a temporary directory and measures, in a
+fresh interpreter for every run, the peak resident set size of scanning
+a folder and planning the operations of all its entries at once. With
+--traced the bytes allocated per entry are counted with tracemalloc as
+well, which is a lot slower. Results are written as JSON so that runs of
+two commits can be compared with --compare."""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from organize import SHAPES, generate_folder, git_commit, namespace, write_config
+
+
+def peak_rss_kib() -> Optional[int]:
+    """Peak resident set size of the process in KiB, None where the
+    resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure_child(config: Path, traced: bool) -> None:
+    """Scans and plans the folder of the config once and prints what it
+    took."""
+    from config import Config
+    from pipeline import plan_folder
+    from scanner import scan_folder
+
+    config_ = Config(config)
+    rules = config_.compile_rules()
+    args_ = namespace(config, True, 1)
+    folder = Path(config_.folders_to_organize[0])
+    if traced:
+        import tracemalloc
+
+        tracemalloc.start()
+    baseline = peak_rss_kib()
+    snapshot = scan_folder(folder)
+    operations = list(plan_folder(snapshot, rules, args_))
+    result: Dict[str, Any] = {"entries": len(snapshot),
+                              "operations": len(operations)}
+    peak = peak_rss_kib()
+    if peak is not None and baseline is not None:
+        result["peak_rss_kib"] = peak - baseline
+        result["rss_bytes_per_entry"] = round(
+            (peak - baseline) * 1024 / max(len(snapshot), 1))
+    if traced:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        result["traced_bytes_per_entry"] = round(
+            traced_peak / max(len(snapshot), 1))
+    print(json.dumps(result), flush=True)
+
+
+def run_child(config: Path, traced: bool) -> Dict[str, Any]:
+    """Measures a run in a fresh interpreter, so earlier runs don't raise
+    its peak."""
+    process = subprocess.run(
+        [sys.executable, __file__, "--child", str(config),
+         *(["--traced"] if traced else [])],
+        capture_output=True, text=True, check=False)
+    if process.returncode != 0:
+        raise RuntimeError(f"Run failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Prints the peak RSS of every result relative to old."""
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for key, result in new["results"].items():
+        before = old["results"].get(key, {}).get("peak_rss_kib")
+        after = result.get("peak_rss_kib")
+        if before and after:
+            print(f"  {key:30} {before / 1024:9.1f} MiB -> "
+                  f"{after / 1024:9.1f} MiB ({after / before:6.2f}x)")
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-f", "--files", type=int, nargs="+",
+                        default=[100000], help="entries per folder")
+    parser.add_argument("-s", "--shape", choices=sorted(SHAPES),
+                        nargs="+", default=["mixed"],
+                        help="kinds of entries to generate")
+    parser.add_argument("--traced", action="store_true",
+                        help="count the bytes allocated per entry")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the generated names")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path,
+                        help="JSON file of an earlier run to compare with")
+    parser.add_argument("--child", type=Path, help=argparse.SUPPRESS)
+    args_ = parser.parse_args()
+
+    if args_.child is not None:
+        measure_child(args_.child, args_.traced)
+        return
+
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory(prefix="myorganizer-bench-") as temp:
+        for count in args_.files:
+            for shape in args_.shape:
+                key = f"scan-plan/{shape}/{count}"
+                folder = Path(temp).joinpath(f"{shape}-{count}")
+                generate_folder(folder, count, shape, args_.seed)
+                config = write_config(
+                    Path(temp).joinpath(f"{shape}-{count}.json"), folder)
+                results[key] = run_child(config, args_.traced)
+                rss = results[key].get("peak_rss_kib")
+                print(f"{key:30} "
+                      + (f"{rss / 1024:9.1f} MiB peak RSS "
+                         f"{results[key]['rss_bytes_per_entry']:>6} B/entry"
+                         if rss is not None else "peak RSS not available")
+                      + (f" {results[key]['traced_bytes_per_entry']:>6} "
+                         "B/entry traced" if args_.traced else ""),
+                      flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args_.output is not None:
+        args_.output.write_text(json.dumps(report, indent=2),
+                                encoding="utf-8")
+    if args_.compare is not None:
+        compare(json.loads(args_.compare.read_text(encoding="utf-8")),
+                report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Throughput benchmark for MyOrganizer.
+
+Generates synthetic folders in a temporary directory and times scanning
+and classification alone, dry runs and real moves through the CLI loop
+and, when PySide6 is installed, through the GUI worker on the offscreen
+Qt platform. Results are written as JSON so that runs of two commits can
+be compared with --compare."""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+SRC = Path(__file__).resolve().parent.parent.joinpath("src")
+sys.path.insert(0, str(SRC))
+
+from config import Config  # noqa: E402
+from scanner import scan_folder  # noqa: E402
+
+CONFIG: Dict[str, Any] = {
+    "file-types": {
+        "txt": "Documents", "pdf": "Documents", "md": "Documents",
+        "docx": "Documents", "jpg": "Pictures", "png": "Pictures",
+        "mp3": "Audio", "tar": "Archives", "zip": "Archives",
+        "gz": "Archives", "xz": "Archives", "py": "Programming",
+        "part": "!ignore",
+    },
+    "special-file-types": {
+        "unknown-extension": "Misc",
+        "no-extension": "Misc",
+        "executable-no-extension": "Executables",
+        "directories": "Folders",
+        "symlinks": "Links",
+        "extracted-archives": "Archives",
+    },
+    "settings": {"handle-locked-files": True},
+}
+
+PLAIN_SUFFIXES = [".txt", ".pdf", ".md", ".docx", ".jpg", ".png", ".mp3",
+                  ".py", ".part"]
+MULTI_SUFFIXES = [".tar.gz", ".tar.xz", ".backup.tar", ".v2.pdf",
+                  ".min.py"]
+WORDS = ["report", "photo", "IMG", "invoice", "notes", "backup", "song",
+         "scan", "draft", "setup", "data", "export"]
+
+# Relative weights of the kinds of entries in every shape.
+SHAPES: Dict[str, Dict[str, int]] = {
+    "mixed": {"plain": 50, "multi-suffix": 10, "lock": 10, "archive": 5,
+              "symlink": 5, "executable": 5, "no-extension": 5,
+              "unknown": 5, "directory": 5},
+    "plain": {"plain": 1},
+    "locked": {"plain": 1, "lock": 1},
+    "archives": {"multi-suffix": 1, "archive": 1},
+    "collisions": {"plain": 1},
+}
+
+# Names already taken in the destination folder for every file of the
+# collisions shape, as name, name(1), ...
+COLLISIONS = 5
+
+SCENARIOS = ["classify", "cli-dry-run", "cli-move", "gui-dry-run",
+             "gui-move"]
+
+
+def destination_of(name: str) -> str:
+    """Folder the benchmark config moves a plain file to."""
+    suffix = Path(name).suffix[1:]
+    return CONFIG["file-types"].get(suffix, "Misc")
+
+
+def generate_folder(folder: Path, count: int, shape: str,
+                    seed: int = 0) -> int:
+    """Fills folder with about count entries of the shape, returns the
+    number of entries created."""
+    rng = random.Random(seed)
+    kinds = list(SHAPES[shape])
+    weights = list(SHAPES[shape].values())
+    folder.mkdir(parents=True, exist_ok=True)
+    created = 0
+    number = 0
+
+    def touch(name: str, mode: int = 0o644) -> None:
+        nonlocal created
+        os.close(os.open(folder.joinpath(name),
+                         os.O_CREAT | os.O_WRONLY | os.O_EXCL, mode))
+        created += 1
+
+    while created < count:
+        number += 1
+        stem = f"{rng.choice(WORDS)}_{number}"
+        match rng.choices(kinds, weights)[0]:
+            case "plain":
+                name = stem + rng.choice(PLAIN_SUFFIXES)
+                touch(name)
+                if shape == "collisions":
+                    destination = folder.joinpath(destination_of(name))
+                    destination.mkdir(exist_ok=True)
+                    suffix = Path(name).suffix
+                    for i in range(COLLISIONS):
+                        taken = name if i == 0 else f"{stem}({i}){suffix}"
+                        destination.joinpath(taken).touch()
+            case "multi-suffix":
+                touch(stem + rng.choice(MULTI_SUFFIXES))
+            case "lock":
+                name = stem + rng.choice(PLAIN_SUFFIXES)
+                touch(name)
+                touch(rng.choice([f"{name}.lock", f"~{name}", f"{name}#"]))
+            case "archive":
+                touch(f"{stem}.zip")
+                folder.joinpath(stem).mkdir()
+                created += 1
+            case "symlink":
+                name = stem + rng.choice(PLAIN_SUFFIXES)
+                touch(name)
+                os.symlink(name, folder.joinpath(f"link_to_{name}"))
+                created += 1
+            case "executable":
+                touch(stem, 0o755)
+            case "no-extension":
+                touch(stem)
+            case "unknown":
+                touch(f"{stem}.x{rng.randrange(1000)}")
+            case "directory":
+                folder.joinpath(f"dir_{stem}").mkdir()
+                created += 1
+    return created
+
+
+def write_config(path: Path, folder: Path) -> Path:
+    """Writes the benchmark config for folder, returns its path."""
+    path.write_text(json.dumps({**CONFIG,
+                                "folders-to-organize": [str(folder)]}),
+                    encoding="utf-8")
+    return path
+
+
+def namespace(config: Path, dry_run: bool, jobs: int) -> argparse.Namespace:
+    """Arguments as the MyOrganizer parser would return them."""
+    return argparse.Namespace(dry_run=dry_run, verbose=False, gui=False,
+                              quiet=True, debug=False, jobs=jobs,
+                              incremental=False, reset_state=False,
+                              watch=False, stats=None, config=config)
+
+
+def time_classify(config: Path) -> float:
+    """Times scanning the folder and classifying every entry."""
+    config_ = Config(config)
+    rules = config_.compile_rules()
+    args_ = namespace(config, True, 1)
+    start = time.perf_counter()
+    for folder in config_.folders_to_organize:
+        for _ in rules.classify(scan_folder(Path(folder)), args_):
+            pass
+    return time.perf_counter() - start
+
+
+def time_cli(config: Path, dry_run: bool, jobs: int) -> float:
+    """Times organize_folders_cli."""
+    from main import organize_folders_cli
+
+    config_ = Config(config)
+    start = time.perf_counter()
+    organize_folders_cli(config=config_,
+                         args_=namespace(config, dry_run, jobs))
+    return time.perf_counter() - start
+
+
+def time_gui(config: Path, dry_run: bool, jobs: int) -> float:
+    """Times the GUI worker in a child process, every process can only
+    create one QApplication."""
+    process = subprocess.run(
+        [sys.executable, __file__, "--gui-child", str(config),
+         *(["--dry-run"] if dry_run else []), "--jobs", str(jobs)],
+        capture_output=True, text=True, check=False,
+        env={**os.environ, "QT_QPA_PLATFORM": "offscreen"})
+    if process.returncode != 0:
+        raise RuntimeError(f"GUI run failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.splitlines()[-1])["seconds"]
+
+
+def gui_child(config: Path, dry_run: bool, jobs: int) -> None:
+    """Runs the GUI once and prints the time the worker took."""
+    from PySide6.QtWidgets import QApplication
+    from gui import QLoad
+
+    app = QApplication([])
+    window = QLoad(config=Config(config),
+                   args_=namespace(config, dry_run, jobs))
+    started: List[float] = []
+    # The worker thread is started by this timer.
+    window.wait_timer.timeout.connect(
+        lambda: started.append(time.perf_counter()))
+    window.show()
+    app.exec()
+    print(json.dumps({"seconds": time.perf_counter() - started[0]}),
+          flush=True)
+    # Qt's teardown is not part of the measurement.
+    os._exit(0)
+
+
+def has_pyside() -> bool:
+    """Whether the GUI scenarios can run."""
+    try:
+        import PySide6  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run_scenario(scenario: str, work: Path, count: int, shape: str,
+                 repeat: int, jobs: int, seed: int) -> Dict[str, Any]:
+    """Runs a scenario repeat times and returns its timings."""
+    runs: List[float] = []
+    entries = 0
+    mutates = scenario.endswith("move")
+    timer: Callable[[Path], float] = {
+        "classify": time_classify,
+        "cli-dry-run": lambda config: time_cli(config, True, jobs),
+        "cli-move": lambda config: time_cli(config, False, jobs),
+        "gui-dry-run": lambda config: time_gui(config, True, jobs),
+        "gui-move": lambda config: time_gui(config, False, jobs),
+    }[scenario]
+
+    folder = work.joinpath("folder")
+    config = write_config(work.joinpath("config.json"), folder)
+    for run in range(repeat):
+        if run == 0 or mutates:
+            shutil.rmtree(folder, ignore_errors=True)
+            entries = generate_folder(folder, count, shape, seed)
+        runs.append(timer(config))
+    shutil.rmtree(folder, ignore_errors=True)
+
+    median = statistics.median(runs)
+    return {
+        "entries": entries,
+        "runs_s": [round(run, 4) for run in runs],
+        "median_s": round(median, 4),
+        "min_s": round(min(runs), 4),
+        "entries_per_s": round(entries / median) if median else None,
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Commit the benchmarked tree is at, if it is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Prints the median time of every result relative to old."""
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for key, result in new["results"].items():
+        before = old["results"].get(key, {}).get("median_s")
+        after = result.get("median_s")
+        if before and after:
+            print(f"  {key:40} {before:9.3f} s -> {after:9.3f} s "
+                  f"({after / before:6.2f}x)")
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-f", "--files", type=int, nargs="+",
+                        default=[10000], help="entries per folder")
+    parser.add_argument("-s", "--shape", choices=sorted(SHAPES),
+                        nargs="+", default=["mixed"],
+                        help="kinds of entries to generate")
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="+",
+                        default=SCENARIOS, help="what to time")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="runs of every scenario")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="--jobs passed to MyOrganizer")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the generated names")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path,
+                        help="JSON file of an earlier run to compare with")
+    parser.add_argument("--gui-child", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--dry-run", action="store_true",
+                        help=argparse.SUPPRESS)
+    args_ = parser.parse_args()
+
+    if args_.gui_child is not None:
+        gui_child(args_.gui_child, args_.dry_run, args_.jobs)
+        return
+
+    results: Dict[str, Any] = {}
+    gui = has_pyside()
+    with tempfile.TemporaryDirectory(prefix="myorganizer-bench-") as temp:
+        for count in args_.files:
+            for shape in args_.shape:
+                for scenario in args_.scenario:
+                    key = f"{scenario}/{shape}/{count}"
+                    if scenario.startswith("gui") and not gui:
+                        results[key] = {"skipped": "PySide6 is not installed"}
+                        continue
+                    results[key] = run_scenario(
+                        scenario, Path(temp), count, shape,
+                        max(1, args_.repeat), args_.jobs, args_.seed)
+                    print(f"{key:40} {results[key]['median_s']:9.3f} s "
+                          f"{results[key]['entries_per_s']:>9} entries/s",
+                          flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "jobs": args_.jobs,
+        "repeat": args_.repeat,
+        "results": results,
+    }
+    if args_.output is not None:
+        args_.output.write_text(json.dumps(report, indent=2),
+                                encoding="utf-8")
+    if args_.compare is not None:
+        compare(json.loads(args_.compare.read_text(encoding="utf-8")),
+                report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Startup benchmark for CLI runs of MyOrganizer.
+
+Runs the CLI on an empty folder with python -X importtime and fails when
+modules that CLI runs must not load are imported, or when the median
+import time exceeds --max-ms."""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+MAIN = Path(__file__).resolve().parent.parent.joinpath("src/main.py")
+
+# Modules that must only be imported by GUI runs or by rules needing them.
+FORBIDDEN = ("PySide6", "shiboken6", "gui", "send2trash",
+             "concurrent.futures")
+
+
+def parse_importtime(stderr: str) -> Tuple[float, Dict[str, float]]:
+    """Returns the total import time in ms and the cumulative time of
+    every imported module."""
+    total = 0.0
+    modules: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+        if not name[1:].startswith(" "):
+            total += int(cumulative) / 1000
+    return total, modules
+
+
+def run_once(config: Path) -> Tuple[float, float, Dict[str, float]]:
+    """Runs the CLI once, returns wall time, import time and modules."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MAIN),
+         "-c", str(config), "-q"],
+        capture_output=True, text=True, check=False)
+    wall = (time.perf_counter() - start) * 1000
+    # A successful CLI run exits with os.X_OK.
+    if process.returncode not in (0, os.X_OK):
+        raise RuntimeError(f"MyOrganizer exited with {process.returncode}:"
+                           f"\n{process.stderr[-2000:]}")
+    total, modules = parse_importtime(process.stderr)
+    return wall, total, modules
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=5,
+                        help="number of runs")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail when the median import time is higher")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args_ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        folder = Path(temp_dir).joinpath("folder")
+        folder.mkdir()
+        config = Path(temp_dir).joinpath("config.json")
+        config.write_text(json.dumps({
+            "file-types": {"pdf": "Documents", "tmp": "!movetotrash"},
+            "folders-to-organize": [str(folder)],
+        }), encoding="utf-8")
+
+        walls: List[float] = []
+        imports: List[float] = []
+        modules: Dict[str, float] = {}
+        for _ in range(max(1, args_.runs)):
+            wall, total, modules = run_once(config)
+            walls.append(wall)
+            imports.append(total)
+
+    forbidden = sorted(name for name in modules
+                       if name.split(".")[0] in FORBIDDEN
+                       or name in FORBIDDEN)
+    slowest = sorted(((time_, name) for name, time_ in modules.items()
+                      if " " not in name), reverse=True)[:10]
+    results = {
+        "runs": len(walls),
+        "median_wall_ms": round(statistics.median(walls), 2),
+        "median_import_ms": round(statistics.median(imports), 2),
+        "slowest_imports_ms": {name: time_ for time_, name in slowest},
+        "forbidden_imports": forbidden,
+    }
+
+    if args_.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"Median wall time:   {results['median_wall_ms']} ms")
+        print(f"Median import time: {results['median_import_ms']} ms")
+        for name, time_ in results["slowest_imports_ms"].items():
+            print(f"  {time_:8.2f} ms  {name}")
+
+    failed = False
+    if forbidden:
+        print(f"CLI startup imported {', '.join(forbidden)}",
+              file=sys.stderr)
+        failed = True
+    if args_.max_ms is not None and results["median_import_ms"] > args_.max_ms:
+        print(f"Median import time {results['median_import_ms']} ms is over "
+              f"{args_.max_ms} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
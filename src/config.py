@@ -1,8 +1,12 @@
 """Configuration tools used by MyOrganizer"""
 from pathlib import Path
 from typing import Dict, List, overload, Optional, Union, Any
+import hashlib
 import json
 
+from rules import Rules
+from throttle import THROTTLE_KEYS, ThrottleSettings
+
 
 class Config:
     """Configuration class used by MyOrganizer for the handling of config.json"""
@@ -28,8 +32,11 @@ class Config:
         self.folders_to_organize: List[str] = []
         self.special_file_types: Dict[str, str] = {}
         self.settings: Dict[str, Any] = {}
+        self.pattern_rules: List[Dict[str, Any]] = []
+        self.throttle_settings: Optional[ThrottleSettings] = None
 
         self.__have_read_file: bool = False
+        self.__rules: Optional[Rules] = None
 
         if json_file is not None:
             self.read_file(json_file=json_file)
@@ -80,6 +87,21 @@ class Config:
                     self.settings = {
                         "handle-locked-Files": False
                     }
+                try:
+                    self.throttle_settings = ThrottleSettings.from_settings(
+                        self.settings)
+                except ValueError as exc:
+                    raise self.InvalidConfigError(
+                        f"settings in {json_file.name}: {exc}") from exc
+
+                if "pattern-rules" in temp:
+                    self.pattern_rules = temp["pattern-rules"]
+                    try:
+                        self.compile_rules()
+                    except ValueError as exc:
+                        raise self.InvalidConfigError(
+                            f"pattern-rules in {json_file.name}: {exc}"
+                        ) from exc
                 file.close()
         except FileNotFoundError as exc:
             with open(json_file, "x", encoding="utf-8") as file:
@@ -93,6 +115,27 @@ class Config:
                 file.close()
             raise FileNotFoundError from exc
 
+    def digest(self) -> str:
+        """Returns a hash of everything that affects classification."""
+        # Limits only change how fast a run goes.
+        settings = {key: value for key, value in self.settings.items()
+                    if key not in THROTTLE_KEYS}
+        values: List[Any] = [self.file_types_var, self.special_file_types,
+                             settings]
+        if self.pattern_rules:
+            values.append(self.pattern_rules)
+        return hashlib.sha256(json.dumps(
+            values, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def compile_rules(self) -> Rules:
+        """Compiles the configuration into lookup tables once."""
+        if self.__rules is None:
+            self.__rules = Rules.compile(self.file_types_var,
+                                         self.special_file_types,
+                                         self.settings,
+                                         self.pattern_rules)
+        return self.__rules
+
     class AlreadyRunError(Exception):
         """Exception to raise when read_file is run more than once."""
 
@@ -104,3 +147,6 @@ class Config:
 
         def __init__(self, *args: object) -> None:
             super().__init__(*args)
+
+    class InvalidConfigError(InadequateConfigError):
+        """Exception to raise when a value of the configuration file is invalid."""
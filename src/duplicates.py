@@ -0,0 +1,229 @@
+"""Content based duplicate detection used by MyOrganizer"""
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import hashlib
+import mmap
+import os
+import re
+
+from filecache import CachedReader, FileCache, cache_path
+from scanner import EntryStat, ScanEntry, scan_folder
+
+DIGEST_FILE_NAME = "digests.sqlite3"
+# Bytes hashed at the start and at the end of a file in the first tier.
+BLOCK_SIZE = 64 * 1024
+# Bytes to read below which hashing stays on the calling thread.
+POOL_THRESHOLD = 8 * 1024 * 1024
+
+_COPY_COUNTER = re.compile(r"\(\d+\)")
+
+
+def digest_path(config_file: Path | str) -> Path:
+    """Returns the path of the digest cache next to the config file."""
+    return cache_path(config_file, DIGEST_FILE_NAME)
+
+
+def edge_digest(path: str) -> bytes:
+    """Hashes the first and the last block of a file. Files of up to two
+    blocks are hashed whole, so the result is also their full digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        digest.update(file.read(BLOCK_SIZE))
+        if size > 2 * BLOCK_SIZE:
+            file.seek(-BLOCK_SIZE, os.SEEK_END)
+        digest.update(file.read(BLOCK_SIZE))
+    return digest.digest()
+
+
+def full_digest(path: str) -> bytes:
+    """Hashes a whole file, reading it through mmap."""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                digest.update(view)
+    return digest.digest()
+
+
+class DigestCache(FileCache):
+    """Edge and full digests of earlier runs."""
+    table = "digests"
+    columns = ("edge BLOB", "full BLOB")
+
+    def __init__(self, database: Path | str) -> None:
+        super().__init__(database)
+        self.hits: int = 0
+
+    def get(self, stat_result: EntryStat
+            ) -> Tuple[Optional[bytes], Optional[bytes]]:
+        """Returns the cached edge and full digest of a file."""
+        values = self.lookup([stat_result]).get(
+            (stat_result.st_dev, stat_result.st_ino))
+        if values is None:
+            return None, None
+        self.hits += 1
+        return values[0], values[1]
+
+    def put(self, stat_result: EntryStat, edge: Optional[bytes],
+            full: Optional[bytes]) -> None:
+        """Records the digests of a file."""
+        self.record([(stat_result, (edge, full))])
+
+
+class _Candidate:
+    """A file taking part in the comparison."""
+
+    def __init__(self, entry: ScanEntry, organized: bool) -> None:
+        self.entry = entry
+        # Files already in a destination folder are never duplicates.
+        self.organized = organized
+        self.edge: Optional[bytes] = None
+        self.full: Optional[bytes] = None
+
+    @property
+    def rank(self) -> tuple:
+        """Sort key, the first candidate of a group is kept."""
+        assert self.entry.stat is not None
+        return (not self.organized,
+                _COPY_COUNTER.search(self.entry.name) is not None,
+                self.entry.stat.st_mtime_ns, len(self.entry.name),
+                self.entry.name)
+
+
+class DuplicateFinder(CachedReader):
+    """Finds files with the same content as another file of their folder
+    or of the destination folder they are about to be moved to.
+
+    Candidates are grouped by size, then by a digest of their first and
+    last block and only then by a digest of their whole content, so most
+    files are never read in full. Digests are cached across runs, with
+    jobs above 1 they are computed on a thread pool, hashlib releases the
+    GIL while hashing. Of every group the
+    file already in a destination folder is kept, otherwise the one
+    without a (1) counter in its name, then the oldest one."""
+
+    cache: Optional[DigestCache]
+
+    def __init__(self, cache: Optional[DigestCache] = None, jobs: int = 1
+                 ) -> None:
+        super().__init__(cache, jobs)
+        self.hashed: int = 0
+
+    def __map(self, function: Callable[[str], bytes], paths: List[str],
+              size: int) -> Iterable[Optional[bytes]]:
+        """Digests of the paths, None for files that can not be read. size
+        is the number of bytes hashing them reads."""
+        self.hashed += len(paths)
+        if self.jobs > 1 and len(paths) > 1 and size >= POOL_THRESHOLD:
+            futures = [self.pool.submit(function, path) for path in paths]
+            for future in futures:
+                exc = future.exception()
+                if exc is not None and not isinstance(exc, OSError):
+                    raise exc
+                yield None if exc is not None else future.result()
+            return
+        for path in paths:
+            try:
+                yield function(path)
+            except OSError:
+                yield None
+
+    def __digest(self, candidates: List[_Candidate], full: bool) -> None:
+        attribute = "full" if full else "edge"
+        missing: List[_Candidate] = []
+        for candidate in candidates:
+            if getattr(candidate, attribute) is not None:
+                continue
+            assert candidate.entry.stat is not None
+            if full and candidate.entry.stat.st_size <= 2 * BLOCK_SIZE:
+                # The edge digest already covers the whole file.
+                candidate.full = candidate.edge
+                continue
+            missing.append(candidate)
+        function = full_digest if full else edge_digest
+        size = sum(candidate.entry.stat.st_size if full
+                   else min(candidate.entry.stat.st_size, 2 * BLOCK_SIZE)
+                   for candidate in missing
+                   if candidate.entry.stat is not None)
+        for candidate, digest in zip(missing, self.__map(
+                function, [str(candidate.entry)
+                           for candidate in missing], size)):
+            setattr(candidate, attribute, digest)
+            if self.cache is not None and digest is not None:
+                assert candidate.entry.stat is not None
+                self.cache.put(candidate.entry.stat, candidate.edge,
+                               candidate.full)
+
+    @staticmethod
+    def __groups(candidates: Iterable[_Candidate],
+                 key: Callable[[_Candidate], object]
+                 ) -> List[List[_Candidate]]:
+        """Groups of at least two candidates sharing the key, with at
+        least one of them not organized yet."""
+        groups: Dict[object, List[_Candidate]] = defaultdict(list)
+        for candidate in candidates:
+            value = key(candidate)
+            if value is not None:
+                groups[value].append(candidate)
+        return [group for group in groups.values() if len(group) > 1
+                and not all(candidate.organized for candidate in group)]
+
+    def find(self, files: Iterable[ScanEntry],
+             organized: Iterable[ScanEntry] = ()) -> Set[ScanEntry]:
+        """Returns the files that duplicate another one of files or of
+        organized, the files in the destination folders."""
+        candidates = [_Candidate(entry, False) for entry in files
+                      if _comparable(entry)]
+        sizes = {candidate.entry.stat.st_size for candidate in candidates
+                 if candidate.entry.stat is not None}
+        candidates.extend(_Candidate(entry, True) for entry in organized
+                          if _comparable(entry) and entry.stat is not None
+                          and entry.stat.st_size in sizes)
+
+        duplicates: Set[ScanEntry] = set()
+        for by_size in self.__groups(
+                candidates, lambda candidate: candidate.entry.stat.st_size):
+            if self.cache is not None:
+                for candidate in by_size:
+                    assert candidate.entry.stat is not None
+                    candidate.edge, candidate.full = self.cache.get(
+                        candidate.entry.stat)
+            self.__digest(by_size, full=False)
+            for by_edge in self.__groups(by_size,
+                                         lambda candidate: candidate.edge):
+                self.__digest(by_edge, full=True)
+                for group in self.__groups(by_edge,
+                                           lambda candidate: candidate.full):
+                    group.sort(key=lambda candidate: candidate.rank)
+                    duplicates.update(candidate.entry for candidate
+                                      in group[1:]
+                                      if not candidate.organized)
+        if self.cache is not None:
+            # Other processes may share the cache, don't hold its lock.
+            self.cache.connection.commit()
+        return duplicates
+
+    def find_in_folder(self, folder: Path,
+                       classified: List[Tuple[ScanEntry, str]]
+                       ) -> Set[ScanEntry]:
+        """Returns the duplicates among the classified entries of a
+        folder that are about to be moved, comparing them with each other
+        and with the files in their destination folders."""
+        moving = [file for file, folder_name in classified
+                  if not folder_name.startswith("!")]
+        organized: List[ScanEntry] = []
+        for folder_name in {folder_name for _, folder_name in classified
+                            if not folder_name.startswith("!")}:
+            try:
+                organized.extend(scan_folder(folder.joinpath(folder_name)))
+            except OSError:
+                continue
+        return self.find(moving, organized)
+
+
+def _comparable(entry: ScanEntry) -> bool:
+    """Whether the entry is a readable, non-empty regular file."""
+    return (entry.is_regular_file and entry.readable
+            and entry.stat is not None and entry.stat.st_size > 0)
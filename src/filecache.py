@@ -0,0 +1,105 @@
+"""Per-file caches and thread pools shared by the reading stages of
+MyOrganizer"""
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import sqlite3
+
+from scanner import EntryStat
+
+if TYPE_CHECKING:
+    from concurrent.futures import ThreadPoolExecutor
+
+# Files looked up in a cache by one query.
+CACHE_BATCH = 400
+
+
+def cache_path(config_file: Path | str, file_name: str) -> Path:
+    """Returns the path of a cache next to the config file."""
+    return Path(config_file).resolve().parent.joinpath(file_name)
+
+
+class FileCache:
+    """Values of earlier runs keyed by device and inode. An entry is only
+    used while size and mtime are unchanged, moves on the same device keep
+    it valid. Subclasses name the table and define its value columns,
+    such as "edge BLOB"."""
+    table: str = ""
+    columns: Tuple[str, ...] = ()
+
+    def __init__(self, database: Path | str) -> None:
+        self.database = Path(database)
+        self.connection = sqlite3.connect(self.database)
+        with self.connection:
+            self.connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    dev INTEGER, inode INTEGER, size INTEGER,
+                    mtime_ns INTEGER, {", ".join(self.columns)},
+                    PRIMARY KEY (dev, inode))""")
+
+    def lookup(self, stat_results: List[EntryStat]
+               ) -> Dict[Tuple[int, int], Tuple[Any, ...]]:
+        """Returns the cached values of the files that are unchanged,
+        keyed by device and inode."""
+        wanted = {(stat_result.st_dev, stat_result.st_ino):
+                  (stat_result.st_size, stat_result.st_mtime_ns)
+                  for stat_result in stat_results}
+        inodes: Dict[int, List[int]] = {}
+        for dev, inode in wanted:
+            inodes.setdefault(dev, []).append(inode)
+        names = ", ".join(column.split()[0] for column in self.columns)
+        found: Dict[Tuple[int, int], Tuple[Any, ...]] = {}
+        for dev, dev_inodes in inodes.items():
+            for start in range(0, len(dev_inodes), CACHE_BATCH):
+                batch = dev_inodes[start:start + CACHE_BATCH]
+                rows = self.connection.execute(
+                    f"SELECT inode, size, mtime_ns, {names} FROM "
+                    f"{self.table} WHERE dev = ? AND inode IN ("
+                    + ", ".join("?" * len(batch)) + ")", [dev, *batch])
+                for inode, size, mtime_ns, *values in rows:
+                    if wanted[(dev, inode)] == (size, mtime_ns):
+                        found[(dev, inode)] = tuple(values)
+        return found
+
+    def record(self, files: List[Tuple[EntryStat, Tuple[Any, ...]]]
+               ) -> None:
+        """Records the values of files, committed by the caller."""
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, "
+            + ", ".join("?" * len(self.columns)) + ")",
+            [(stat_result.st_dev, stat_result.st_ino, stat_result.st_size,
+              stat_result.st_mtime_ns, *values)
+             for stat_result, values in files])
+
+    def close(self) -> None:
+        """Commits and closes the cache."""
+        self.connection.commit()
+        self.connection.close()
+
+
+class CachedReader:
+    """Base of the stages that read files on a thread pool of jobs
+    threads, started on first use, and keep what they found in a
+    FileCache."""
+
+    def __init__(self, cache: Optional[FileCache] = None, jobs: int = 1
+                 ) -> None:
+        self.cache = cache
+        self.jobs = max(1, jobs)
+        self.__pool: Optional["ThreadPoolExecutor"] = None
+
+    @property
+    def pool(self) -> "ThreadPoolExecutor":
+        """The thread pool, started when it is first used."""
+        if self.__pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self.__pool = ThreadPoolExecutor(max_workers=self.jobs)
+        return self.__pool
+
+    def close(self) -> None:
+        """Stops the thread pool and closes the cache."""
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+        if self.cache is not None:
+            self.cache.close()
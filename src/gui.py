@@ -3,16 +3,26 @@
 
 import errno
 from argparse import Namespace
+from collections import deque
+from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING, Deque, List, Optional, Tuple
 
-from PySide6.QtCore import QObject, QThread, Signal, QTimer
-from PySide6.QtGui import QIcon, QTextCursor
-from PySide6.QtWidgets import (QWidget, QProgressBar, QTextEdit,
-                               QVBoxLayout, QLabel,
-                               QMessageBox)
+from PySide6.QtCore import (QAbstractListModel, QModelIndex, QObject,
+                            QThread, Qt, Signal, QTimer)
+from PySide6.QtGui import QIcon
+from PySide6.QtWidgets import (QWidget, QProgressBar, QListView,
+                               QVBoxLayout, QLabel, QPlainTextEdit,
+                               QTabWidget, QMessageBox)
 
 from config import Config
-from organization_tools import get_folder_name, handle_file
+from output import Batcher
+from pipeline import Executor, RunContext, describe_failure, existing_folders, missing_folder_message
+from scanner import FolderSnapshot
+from throttle import open_throttle
+
+if TYPE_CHECKING:
+    from stats import RunStats
 
 src_icon_path = Path(__file__).resolve().parent.parent.joinpath("img/logo.png")
 ICONPATH: str = (
@@ -20,6 +30,48 @@ ICONPATH: str = (
     else str(Path(__file__).resolve().parent.joinpath("img/logo.png"))
 )
 
+# Lines kept in the log, older ones are dropped.
+LOG_LIMIT = 10000
+
+
+class LogModel(QAbstractListModel):
+    """Log lines, newest message first, capped at limit lines."""
+
+    def __init__(self, limit: int = LOG_LIMIT, parent=None):
+        super().__init__(parent)
+        self.limit = limit
+        self.__lines: Deque[str] = deque()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        """Number of lines shown."""
+        if parent.isValid():
+            return 0
+        return len(self.__lines)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        """Text of a line."""
+        if role == Qt.ItemDataRole.DisplayRole and index.isValid():
+            return self.__lines[index.row()]
+        return None
+
+    def add_messages(self, messages: List[str]):
+        """Adds a batch of messages at the top of the log"""
+        rows: List[str] = []
+        for message in reversed(messages):
+            rows.extend(message.split("\n"))
+        rows = rows[:self.limit]
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self.__lines.extendleft(reversed(rows))
+        self.endInsertRows()
+        if len(self.__lines) > self.limit:
+            self.beginRemoveRows(QModelIndex(), self.limit,
+                                 len(self.__lines) - 1)
+            while len(self.__lines) > self.limit:
+                self.__lines.pop()
+            self.endRemoveRows()
+
 
 class QLoad(QWidget):
     """Custom QWidget for MyOrganizer providing status as GUI."""
@@ -29,8 +81,8 @@ class QLoad(QWidget):
 
         self.setWindowTitle("MyOrganizer")
         self.setWindowIcon(QIcon(ICONPATH))
-        self.setFixedSize(400, 240)
-        self.setMinimumSize(400, 240)
+        self.setFixedSize(400, 270)
+        self.setMinimumSize(400, 270)
 
         self.folder_progress = QProgressBar()
         self.folder_progress.setFormat("Scanning folders... (%v/%m)")
@@ -40,14 +92,31 @@ class QLoad(QWidget):
         self.file_progress = QProgressBar()
         self.file_progress.setFormat("Scanning files... (%v/%m)")
 
-        self.log = QTextEdit()
-        self.log.setReadOnly(True)
+        self.transfer_progress = QProgressBar()
+        self.transfer_progress.setRange(0, 100)
+        self.transfer_progress.setFormat("No copy in progress")
+
+        self.log_model = LogModel(parent=self)
+        self.log = QListView()
+        self.log.setModel(self.log_model)
+        self.log.setUniformItemSizes(True)
 
         layout = QVBoxLayout()
         layout.addWidget(self.folder_progress)
         layout.addWidget(self.label)
         layout.addWidget(self.file_progress)
-        layout.addWidget(self.log)
+        layout.addWidget(self.transfer_progress)
+        # With --stats the log shares its space with the statistics.
+        stats = getattr(args_, "stats", None)
+        if stats:
+            self.stats_panel = QPlainTextEdit()
+            self.stats_panel.setReadOnly(True)
+            self.tabs = QTabWidget()
+            self.tabs.addTab(self.log, "Log")
+            self.tabs.addTab(self.stats_panel, "Statistics")
+            layout.addWidget(self.tabs)
+        else:
+            layout.addWidget(self.log)
 
         self.setLayout(layout)
 
@@ -63,14 +132,21 @@ class QLoad(QWidget):
             self.file_progress.setRange)
         self.worker.file_progress_update_value.connect(
             self.file_progress.setValue)
+        self.worker.transfer_progress_update_value.connect(
+            self.transfer_progress.setValue)
+        self.worker.transfer_progress_set_format.connect(
+            self.transfer_progress.setFormat)
         self.worker.folder_update_label.connect(self.label.setText)
-        self.worker.add_text.connect(self.add_log_text)
-
-        self.worker.update.connect(self.update)
+        self.worker.add_messages.connect(self.log_model.add_messages)
 
         self.worker.finished.connect(self.worker_thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
-        self.worker.finished.connect(self.thread().quit)
+        if stats:
+            # The statistics stay on screen until the window is closed.
+            self.worker.stats_text.connect(self.stats_panel.setPlainText)
+        else:
+            # Quit once the thread has stopped, QLoad destroys it.
+            self.worker_thread.finished.connect(self.thread().quit)
         self.worker_thread.finished.connect(self.worker_thread.deleteLater)
 
         self.worker.moveToThread(self.worker_thread)
@@ -85,66 +161,192 @@ class QLoad(QWidget):
         self.wait_timer.timeout.connect(self.worker_thread.start)
         self.wait_timer.start()
 
-    def add_log_text(self, text: str):
-        """Adds text at the beginning of the log"""
-        self.log.moveCursor(QTextCursor.MoveOperation.Start)
-        self.log.insertPlainText(text)
-
 
 class Worker(QObject):
-    """GUI implementation of organize_folders worker class."""
+    """GUI implementation of organize_folders worker class.
+
+    Log messages and progress are buffered and sent to the window at most
+    every BATCH_INTERVAL seconds, so the event loop of the window is not
+    flooded with one signal per file."""
     folder_progress_update_value = Signal(int)
     file_progress_update_value = Signal(int)
     folder_progress_set_range = Signal(int, int)
     file_progress_set_range = Signal(int, int)
-    add_text = Signal(str)
+    transfer_progress_update_value = Signal(int)
+    transfer_progress_set_format = Signal(str)
+    add_messages = Signal(list)
     folder_update_label = Signal(str)
+    stats_text = Signal(str)
 
-    update = Signal()
     finished = Signal()
 
+    def __init__(self):
+        super().__init__()
+        # Copies report progress from the executor's threads.
+        self.__batcher = Batcher(self.__send)
+        self.__messages: List[str] = []
+        self.__file_value: Optional[int] = None
+        self.__file_maximum: int = 0
+        self.__transfer: Optional[Tuple[str, int]] = None
+
+    def __add_text(self, text: str):
+        with self.__batcher.lock:
+            self.__messages.append(text)
+            if len(self.__messages) > 2 * LOG_LIMIT:
+                # The log would drop them anyway.
+                del self.__messages[:-LOG_LIMIT]
+        self.__flush()
+
+    def __file_done(self, handled: int):
+        with self.__batcher.lock:
+            self.__file_value = min(handled + 1, self.__file_maximum)
+        self.__flush()
+
+    def __copy_progress(self, source: Path, copied: int, size: int):
+        with self.__batcher.lock:
+            self.__transfer = (f"Copying {source.name}... %p%"
+                               if copied < size else "No copy in progress",
+                               copied * 100 // max(size, 1))
+        self.__flush(force=copied >= size)
+
+    def __flush(self, force: bool = False):
+        """Sends what was buffered since the last flush to the window when
+        it is due."""
+        self.__batcher.flush(force)
+
+    def __send(self):
+        if self.__messages:
+            self.add_messages.emit(self.__messages)
+            self.__messages = []
+        if self.__file_value is not None:
+            self.file_progress_update_value.emit(self.__file_value)
+            self.__file_value = None
+        if self.__transfer is not None:
+            self.transfer_progress_set_format.emit(self.__transfer[0])
+            self.transfer_progress_update_value.emit(self.__transfer[1])
+            self.__transfer = None
+
+    def __begin_snapshot(self, snapshot: FolderSnapshot):
+        """Resets the file progress for the next folder of the tree."""
+        self.__flush(force=True)
+        self.folder_update_label.emit(f"Scanning folder: {snapshot.folder}")
+        self.__file_maximum = len(snapshot)
+        self.file_progress_set_range.emit(1, len(snapshot))
+        self.file_progress_update_value.emit(1)
+
+    def __files_done(self, handled: int, total: int):
+        """Shows the progress summed over the folders of worker
+        processes."""
+        if total != self.__file_maximum:
+            self.__file_maximum = total
+            self.file_progress_set_range.emit(0, total)
+        with self.__batcher.lock:
+            self.__file_value = handled
+        self.__flush()
+
+    def __run_processes(self, config: Config, args_: Namespace,
+                        stats: Optional["RunStats"]):
+        """Organizes the folders in worker processes."""
+        from parallel import FolderRun, organize_in_processes
+
+        folders: List[Path] = [folder_path for _, folder_path
+                               in existing_folders(config, partial(
+                                   self.__missing_folder, args_=args_))]
+        self.folder_progress_set_range.emit(0, len(folders))
+        self.folder_update_label.emit(
+            f"Scanning {len(folders)} folders in "
+            f"{min(args_.processes, len(folders))} processes")
+        self.__file_maximum = 0
+        done: List[FolderRun] = []
+
+        def folder_done(run: FolderRun):
+            done.append(run)
+            self.__flush(force=True)
+            self.folder_progress_update_value.emit(len(done))
+
+        # Collects the counters of the workers, which share the limits.
+        throttle = open_throttle(config.throttle_settings)
+        runs = organize_in_processes(args_, folders, args_.processes,
+                                     update_function=self.__add_text,
+                                     progress_function=self.__files_done,
+                                     folder_function=folder_done)
+        for run in runs:
+            for failure in run.failures:
+                self.__add_text(failure)
+            if stats is not None and run.stats is not None:
+                stats.merge(run.stats)
+        if getattr(args_, "incremental", False):
+            self.__add_text(f"Skipped {sum(run.skipped for run in runs)} "
+                            "unchanged ignored entries.")
+        if throttle is not None:
+            for run in runs:
+                if run.throttle is not None:
+                    throttle.merge(run.throttle)
+            self.__add_text(throttle.report())
+
+    def __missing_folder(self, folder_path: Path, args_: Namespace):
+        if not args_.quiet:
+            msgbox = QMessageBox(QMessageBox.Icon.Critical,
+                                 "MyOrganizer",
+                                 missing_folder_message(folder_path))
+            msgbox.setWindowIcon(QIcon(ICONPATH))
+            msgbox.exec()
+            exit(errno.ENOENT)
+
     def run(self, config: Config, args_: Namespace):
         """GUI implementation of organize_folders."""
 
         self.folder_progress_set_range.emit(0, len(config.folders_to_organize))
         folder_val = 0
-
-        for folder in config.folders_to_organize:
-            if folder.startswith("$"):
-                folder = folder.replace("$HOME", str(Path.home()))
-            folder_path = Path(folder)
+        stats = None
+        if getattr(args_, "stats", None):
+            from stats import RunStats
+
+            stats = RunStats()
+        if (getattr(args_, "processes", 1) > 1
+                and len(config.folders_to_organize) > 1):
+            self.__run_processes(config, args_, stats)
+            self.__finish(args_, stats)
+            return
+        throttle = open_throttle(config.throttle_settings)
+        executor = Executor(args_,
+                            update_function=self.__add_text,
+                            progress_function=self.__file_done,
+                            jobs=getattr(args_, "jobs", 1),
+                            byte_progress_function=self.__copy_progress,
+                            batch_size=config.settings.get("batch-size",
+                                                           100),
+                            stats=stats, throttle=throttle)
+
+        context = RunContext(config, args_, stats)
+
+        for folder, folder_path in existing_folders(
+                config, partial(self.__missing_folder, args_=args_)):
             self.folder_update_label.emit(f"Scanning folder: {folder}")
 
-            if not folder_path.exists():
-                if not args_.quiet:
-                    msgbox = QMessageBox(QMessageBox.Icon.Critical,
-                                         "MyOrganizer",
-                                         f"Folder {folder_path.resolve()} does not "
-                                         "exist. Please double-check the path."
-                                         )
-                    msgbox.setWindowIcon(QIcon(ICONPATH))
-                    msgbox.exec()
-                    exit(errno.ENOENT)
-
-            files = list(folder_path.glob("*"))
-
-            self.file_progress_set_range.emit(1, len(files))
-            self.file_progress_update_value.emit(1)
-
-            file_val = 1
-
-            while files:
-                file = files.pop(0)
-                folder_name = get_folder_name(
-                    file=file, files=files, config=config, args_=args_)
-                handle_file(file=file, parent_folder=folder,
-                            folder_name=folder_name, args_=args_,
-                            update_function=lambda text:
-                            self.add_text.emit(f"{text}\n"))
-                file_val += 1
-                self.file_progress_update_value.emit(file_val)
-                self.update.emit()
+            context.organize(folder_path, executor, self.__begin_snapshot)
+            self.__flush(force=True)
+            if stats is not None:
+                self.stats_text.emit(stats.format(args_.stats == "json"))
 
             folder_val += 1
             self.folder_progress_update_value.emit(folder_val)
+        for operation, exc in executor.errors:
+            self.__add_text(describe_failure(operation, exc))
+        context.close()
+        if context.state is not None:
+            self.__add_text(f"Skipped {context.state.skipped} unchanged "
+                            "ignored entries.")
+        if context.plan is not None:
+            self.__add_text(f"Wrote {context.plan.written} operations to "
+                            f"{context.plan.path}.")
+        if throttle is not None:
+            self.__add_text(throttle.report())
+        self.__finish(args_, stats)
+
+    def __finish(self, args_: Namespace, stats: Optional["RunStats"]):
+        self.__flush(force=True)
+        if stats is not None:
+            stats.finish()
+            self.stats_text.emit(stats.format(args_.stats == "json"))
         self.finished.emit()
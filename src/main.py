@@ -1,22 +1,29 @@
 #!/usr/bin/env python3
 
 import argparse
+import atexit
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional, TYPE_CHECKING
 import sys
 import errno
 
 from config import Config
-from organization_tools import get_folder_name, handle_file
+from output import FLUSH_INTERVAL, OUTPUT_FORMATS, OutputSink, open_sink
+from pipeline import Executor, Operation, RunContext, describe_failure, existing_folders, missing_folder_message
+from scanner import FolderSnapshot
+from throttle import open_throttle, set_io_priority
 
-from PySide6.QtWidgets import QMessageBox, QApplication, QWidget
-from PySide6.QtGui import QIcon, QTextCursor
-from PySide6.QtCore import QThread
+if TYPE_CHECKING:
+    from PySide6.QtGui import QIcon
 
-from gui import QLoad, ICONPATH
+    from stats import RunStats
+    from throttle import Throttle
 
-icon: Optional[QIcon] = None
+# Qt, the process and thread pools, the watcher and the other modules of
+# optional features are imported where they are used, so a plain CLI run
+# starts without them. benchmarks/startup.py checks this.
+icon: Optional["QIcon"] = None
 PYTHONFAULTHANDLER = 0
 
 
@@ -41,16 +48,101 @@ def main() -> None:
                         action="store_true")
     parser.add_argument("-D", "--debug", help=argparse.SUPPRESS,
                         action="store_true")
+    parser.add_argument("-j", "--jobs",
+                        help=("number of threads moving, deleting and "
+                              "trashing files, 1 runs them serially"),
+                        type=int, default=1, action="store")
+    parser.add_argument("-P", "--processes",
+                        help=("number of worker processes organizing the "
+                              "configured folders side by side, 1 "
+                              "organizes them one after another"),
+                        type=int, default=1, action="store")
+    parser.add_argument("-i", "--incremental",
+                        help=("skip entries that earlier runs ignored and "
+                              "that did not change since"),
+                        action="store_true")
+    parser.add_argument("--reset-state",
+                        help=("forget what earlier incremental runs "
+                              "recorded"),
+                        action="store_true")
+    parser.add_argument("--stats",
+                        help=("report time per phase, throughput, "
+                              "destinations and the slowest operations, "
+                              "as text or as JSON"),
+                        nargs="?", const="text", choices=["text", "json"],
+                        action="store")
+    parser.add_argument("-r", "--recursive",
+                        help=("organize subfolders as well, except the "
+                              "destination folders"),
+                        action="store_true")
+    parser.add_argument("--max-depth",
+                        help=("deepest subfolder level organized by "
+                              "--recursive, 1 is the direct subfolders"),
+                        type=int, default=None, action="store")
+    parser.add_argument("--exclude",
+                        help=("glob of subfolders --recursive leaves "
+                              "alone, matched against the name and the "
+                              "relative path, can be repeated"),
+                        default=[], action="append", metavar="PATTERN")
+    parser.add_argument("--plan-out",
+                        help=("write the planned operations to this JSON "
+                              "lines file, usually with --dry-run"),
+                        type=Path, default=None, action="store",
+                        metavar="PLAN")
+    parser.add_argument("--apply",
+                        help=("perform the operations of a plan written "
+                              "by --plan-out instead of organizing, "
+                              "skipping entries changed since then; an "
+                              "interrupted run resumes where it stopped"),
+                        type=Path, default=None, action="store",
+                        metavar="PLAN")
+    parser.add_argument("-w", "--watch",
+                        help=("keep running after organizing and handle "
+                              "new and changed entries as they settle"),
+                        action="store_true")
+    parser.add_argument("--debounce",
+                        help=("seconds an entry has to stay unchanged "
+                              "before watch mode handles it"),
+                        type=float, default=2.0, action="store")
+    parser.add_argument("--poll-interval",
+                        help=("seconds between folder listings when watch "
+                              "mode can not use inotify"),
+                        type=float, default=5.0, action="store")
+    parser.add_argument("--polling",
+                        help="make watch mode list folders instead of "
+                             "using inotify",
+                        action="store_true")
+    parser.add_argument("--output",
+                        help=("how operations are reported: text lines, "
+                              "one JSON object per event, or only "
+                              "failures and the summary"),
+                        choices=OUTPUT_FORMATS, default="text",
+                        action="store")
+    parser.add_argument("--flush-interval",
+                        help=("seconds output is collected before it is "
+                              "written, 0 writes every line right away"),
+                        type=float, default=FLUSH_INTERVAL, action="store")
     parser.add_argument("-c", "--config", help="specify config file",
                         default=Path(__file__).resolve()
                         .parent.parent.joinpath("config/config.json"),
                         action="store")
 
     args_ = parser.parse_args()
+    if args_.apply is not None and (args_.gui or args_.watch):
+        parser.error("--apply can not be combined with --gui or --watch")
+    if args_.processes > 1 and args_.plan_out is not None:
+        parser.error("--plan-out can not be combined with --processes")
+    output = open_output(args_)
+    # Lines still buffered when the run exits are written.
+    atexit.register(output.close)
 
     global icon
 
     if args_.gui is True:
+        from PySide6.QtWidgets import QApplication
+        from PySide6.QtGui import QIcon
+        from gui import ICONPATH
+
         app = QApplication(sys.argv)
         icon = QIcon(ICONPATH)
 
@@ -59,16 +151,20 @@ def main() -> None:
         faulthandler.enable()
         global PYTHONFAULTHANDLER
         PYTHONFAULTHANDLER = 1
-        if args_.gui is True and isinstance(icon, QIcon):
+        if args_.gui is True and icon is not None:
+            from PySide6.QtWidgets import QMessageBox
+
             msgbox = QMessageBox(QMessageBox.Icon.Information,
                                  "MyOrganizer", "Debug mode active.")
             msgbox.setWindowIcon(icon)
             msgbox.exec()
         else:
-            print("Debug mode active.")
+            output.message("Debug mode active.")
 
     if args_.dry_run and not args_.quiet:
-        if args_.gui is True and isinstance(icon, QIcon):
+        if args_.gui is True and icon is not None:
+            from PySide6.QtWidgets import QMessageBox
+
             msgbox = QMessageBox(
                 QMessageBox.Icon.Information,
                 "MyOrganizer",
@@ -78,41 +174,93 @@ def main() -> None:
             msgbox.setWindowIcon(icon)
             msgbox.exec()
         else:
-            print("Running dry-run, no file will be modified")
+            output.message("Running dry-run, no file will be modified")
+
+    config = read_config(args_, output.message)
+    io_priority = (config.throttle_settings.io_priority
+                   if config.throttle_settings is not None else None)
+    # Set before any thread or worker process starts, they inherit it.
+    if (io_priority is not None and not set_io_priority(io_priority)
+            and not args_.quiet):
+        output.message("io-priority is not supported on this system, "
+                       "running with the usual I/O priority.")
+
+    if args_.reset_state:
+        from state import StateStore, state_path
 
-    config = read_config(args_)
+        store = StateStore(state_path(args_.config), config.digest())
+        store.invalidate()
+        store.close()
+        if not args_.quiet and not args_.gui:
+            output.message(f"Cleared {store.database}.")
+        if not args_.incremental:
+            sys.exit(os.X_OK)
 
     if args_.gui is True:
+        from gui import QLoad
+
         window = QLoad(config=config, args_=args_)
         window.show()
         sys.exit(app.exec())
+    elif args_.apply is not None:
+        succeeded = apply_plan_cli(config=config, args_=args_,
+                                   output=output)
     else:
-        organize_folders_cli(config=config, args_=args_)
+        succeeded = organize_folders_cli(config=config, args_=args_,
+                                         output=output)
+        if args_.watch:
+            # Failures of the first pass still count once watching stops.
+            succeeded = watch_folders_cli(config=config, args_=args_,
+                                          output=output) and succeeded
+    if succeeded:
         sys.exit(os.X_OK)
+    sys.exit(errno.EIO)
 
 
-def read_config(args_: argparse.Namespace) -> Config:
-    """Reads the config file and handles possible exceptions."""
+def read_config(args_: argparse.Namespace,
+                update_function: Callable[[str], None] = print) -> Config:
+    """Reads the config file and handles possible exceptions, reporting
+    them to update_function outside the GUI."""
     try:
         config = Config(args_.config)
-    except Config.InadequateConfigError:
+    except Config.InvalidConfigError as exc:
+        if not args_.quiet:
+            if args_.gui is True and icon is not None:
+                from PySide6.QtWidgets import QMessageBox
+
+                msgbox = QMessageBox(QMessageBox.Icon.Critical,
+                                     "MyOrganizer", "Configuration file "
+                                                    "is invalid. Please "
+                                                    "correct it.\nDetails: "
+                                                    f"{exc}")
+                msgbox.setWindowIcon(icon)
+                msgbox.exec()
+            else:
+                update_function("Configuration file is invalid. Please "
+                                f"correct it.\nDetails: {exc}")
+        sys.exit(3)
+    except Config.InadequateConfigError as exc:
         if not args_.quiet:
-            if args_.gui is True and isinstance(icon, QIcon):
+            if args_.gui is True and icon is not None:
+                from PySide6.QtWidgets import QMessageBox
+
                 msgbox = QMessageBox(QMessageBox.Icon.Warning,
                                      "MyOrganizer", "Configuration file "
                                                     "was missing and was automatically "
                                                     "generated. Please edit it "
-                                                    "as necessary.")
+                                                    f"as necessary.\nDetails: {exc}")
                 msgbox.setWindowIcon(icon)
                 msgbox.exec()
             else:
-                print("Configuration file was missing and was "
-                      "automatically generated. Please edit "
-                      "it as necessary.")
+                update_function("Configuration file was missing and was "
+                                "automatically generated. Please edit "
+                                f"it as necessary.\nDetails: {exc}")
         sys.exit(3)
     except FileNotFoundError:
         if not args_.quiet:
-            if args_.gui is True and isinstance(icon, QIcon):
+            if args_.gui is True and icon is not None:
+                from PySide6.QtWidgets import QMessageBox
+
                 msgbox = QMessageBox(QMessageBox.Icon.Warning,
                                      "MyOrganizer", "Configuration file "
                                                     "was missing and was automatically "
@@ -121,13 +269,15 @@ def read_config(args_: argparse.Namespace) -> Config:
                 msgbox.setWindowIcon(icon)
                 msgbox.exec()
             else:
-                print("Configuration file was missing and was "
-                      "automatically generated. Please edit "
-                      "it as necessary.")
+                update_function("Configuration file was missing and was "
+                                "automatically generated. Please edit "
+                                "it as necessary.")
         sys.exit(errno.ENOENT)
     except PermissionError:
         if not args_.quiet:
-            if args_.gui is True and isinstance(icon, QIcon):
+            if args_.gui is True and icon is not None:
+                from PySide6.QtWidgets import QMessageBox
+
                 msgbox = QMessageBox(QMessageBox.Icon.Critical,
                                      "MyOrganizer", "You do not have adequate"
                                                     " permission to read "
@@ -135,54 +285,263 @@ def read_config(args_: argparse.Namespace) -> Config:
                 msgbox.setWindowIcon(icon)
                 msgbox.exec()
             else:
-                print("You do not have adequate permission to read"
-                      f"{args_.config.name}.")
+                update_function("You do not have adequate permission to "
+                                f"read{args_.config.name}.")
         sys.exit(errno.EPERM)
     except OSError as exc:
         if not args_.quiet:
-            if args_.gui is True and isinstance(icon, QIcon):
+            if args_.gui is True and icon is not None:
+                from PySide6.QtWidgets import QMessageBox
+
                 msgbox = QMessageBox(QMessageBox.Icon.Critical,
                                      "MyOrganizer", f"An exception was raised."
                                                     f" Details:\n{type(exc).__name__}: {exc}")
                 msgbox.setWindowIcon(icon)
                 msgbox.exec()
             else:
-                print("Configuration file could not be read. Please make "
-                      "sure that you have read permission to the file.")
+                update_function("Configuration file could not be read. "
+                                "Please make sure that you have read "
+                                "permission to the file.")
         sys.exit(errno.EIO)
 
     return config
 
 
-def organize_folders_cli(config: Config,
-                         args_: argparse.Namespace):
-    """Organizes the folders. Main part of MyOrganizer."""
+def print_copy_progress(source: Path, copied: int, size: int) -> None:
+    """Prints the progress of a copy to another filesystem."""
+    print(f"\rCopying {source.name}: {copied * 100 // max(size, 1)}% "
+          f"({copied // 1048576}/{size // 1048576} MiB)",
+          end="\n" if copied >= size else "", file=sys.stderr, flush=True)
+
+
+def open_output(args_: argparse.Namespace) -> OutputSink:
+    """Returns the sink of the --output format of a run. Debug runs write
+    every line right away, next to the classification printed on
+    stderr."""
+    return open_sink(getattr(args_, "output", "text"),
+                     0.0 if args_.debug
+                     else getattr(args_, "flush_interval", FLUSH_INTERVAL))
+
+
+def cli_executor(config: Config, args_: argparse.Namespace,
+                 output: OutputSink, stats: Optional["RunStats"] = None,
+                 completed_function: Optional[
+                     Callable[[Operation], None]] = None,
+                 throttle: Optional["Throttle"] = None) -> Executor:
+    """Returns the executor of a CLI run reporting to output."""
+
+    def copy_progress(source: Path, copied: int, size: int) -> None:
+        # The move being copied is reported first.
+        output.flush()
+        print_copy_progress(source, copied, size)
+
+    return Executor(args_, update_function=output.message, jobs=args_.jobs,
+                    byte_progress_function=None if args_.quiet
+                    else copy_progress,
+                    batch_size=config.settings.get("batch-size", 100),
+                    stats=stats, completed_function=completed_function,
+                    operation_function=output.operation, throttle=throttle)
+
+
+def missing_folder_function(args_: argparse.Namespace, output: OutputSink
+                            ) -> Optional[Callable[[Path], None]]:
+    """Returns the function reporting missing folders to output, None in
+    quiet runs."""
+    if args_.quiet:
+        return None
+    return lambda folder_path: output.message(
+        missing_folder_message(folder_path))
+
+
+def organize_folders_cli(config: Config, args_: argparse.Namespace,
+                         output: Optional[OutputSink] = None) -> bool:
+    """Organizes the folders. Main part of MyOrganizer. Returns whether
+    every operation succeeded."""
+    if output is None:
+        output = open_output(args_)
 
     file_val = 0
+    folder_count = 0
+    stats = None
+    if args_.stats:
+        from stats import RunStats
+
+        stats = RunStats()
+    if (getattr(args_, "processes", 1) > 1
+            and len(config.folders_to_organize) > 1):
+        return organize_folders_parallel_cli(config, args_, output, stats)
+    throttle = open_throttle(config.throttle_settings)
+    executor = cli_executor(config, args_, output, stats, throttle=throttle)
+
+    context = RunContext(config, args_, stats)
+    state = context.state
+    plan = context.plan
 
-    for folder in config.folders_to_organize:
-        if folder.startswith("$"):
-            folder = folder.replace("$HOME", str(Path.home()))
-        folder_path = Path(folder)
-
-        if not folder_path.exists():
-            if not args_.quiet:
-                print(f"Folder {folder_path.resolve()} does not exist."
-                      " Please double-check the path.")
-
-        files = list(folder_path.iterdir())
-
-        while files:
-            file = files.pop(0)
-            folder_name = get_folder_name(
-                file=file, files=files, config=config, args_=args_)
-            handle_file(file=file, parent_folder=folder,
-                        folder_name=folder_name, args_=args_,
-                        update_function=print)
-            file_val += 1
+    def print_syscalls(snapshot: FolderSnapshot) -> None:
+        output.message(f"{snapshot.syscalls} syscalls while scanning "
+                       f"{snapshot.folder}")
+
+    for _, folder_path in existing_folders(
+            config, missing_folder_function(args_, output)):
+        handled, scanned = context.organize(
+            folder_path, executor, print_syscalls
+            if args_.debug and not args_.quiet else None)
+        file_val += handled
+        folder_count += scanned
+    context.close()
     if not args_.quiet:
-        print(f"Processed {file_val} files in {len(config.folders_to_organize)} folders.")
+        for operation, exc in executor.errors:
+            output.failure(describe_failure(operation, exc))
+        output.message(f"Processed {file_val} files in {folder_count} "
+                       "folders.")
+        if plan is not None:
+            output.message(f"Wrote {plan.written} operations to "
+                           f"{plan.path}.")
+        if state is not None:
+            output.message(f"Skipped {state.skipped} unchanged ignored "
+                           f"entries, recorded {state.recorded} newly "
+                           "ignored entries.")
+        if throttle is not None:
+            output.message(throttle.report())
+    if stats is not None:
+        # Printed with --quiet as well, it was asked for explicitly.
+        stats.finish()
+        output.stats(stats, as_json=args_.stats == "json")
+    output.flush()
+    return not executor.errors
+
+
+def organize_folders_parallel_cli(config: Config,
+                                  args_: argparse.Namespace,
+                                  output: OutputSink,
+                                  stats: Optional["RunStats"]) -> bool:
+    """Organizes the folders in worker processes. Returns whether every
+    operation succeeded."""
+    from parallel import organize_in_processes
+
+    folders: List[Path] = [folder_path for _, folder_path in existing_folders(
+        config, missing_folder_function(args_, output))]
+
+    # Collects the counters of the workers, which share the limits.
+    throttle = open_throttle(config.throttle_settings)
+    runs = organize_in_processes(args_, folders, args_.processes,
+                                 update_function=output.message,
+                                 operation_function=output.operation)
+    failures = [failure for run in runs for failure in run.failures]
+    if not args_.quiet:
+        for failure in failures:
+            output.failure(failure)
+        output.message(f"Processed {sum(run.handled for run in runs)} files "
+                       f"in {sum(run.scanned for run in runs)} folders.")
+        if args_.incremental:
+            output.message(f"Skipped {sum(run.skipped for run in runs)} "
+                           "unchanged ignored entries, recorded "
+                           f"{sum(run.recorded for run in runs)} newly "
+                           "ignored entries.")
+        if throttle is not None:
+            for run in runs:
+                if run.throttle is not None:
+                    throttle.merge(run.throttle)
+            output.message(throttle.report())
+    if stats is not None:
+        for run in runs:
+            if run.stats is not None:
+                stats.merge(run.stats)
+        stats.finish()
+        output.stats(stats, as_json=args_.stats == "json")
+    output.flush()
+    return not failures
+
+
+def apply_plan_cli(config: Config, args_: argparse.Namespace,
+                   output: Optional[OutputSink] = None) -> bool:
+    """Performs the operations of a plan file. Returns whether every
+    operation succeeded."""
+    from plan import PlanApplier
+
+    if output is None:
+        output = open_output(args_)
+    stats = None
+    if args_.stats:
+        from stats import RunStats
+
+        stats = RunStats()
+    try:
+        applier = PlanApplier(args_.apply,
+                              update_function=None if args_.quiet
+                              else output.message,
+                              journal=not args_.dry_run)
+    except (OSError, ValueError) as exc:
+        if not args_.quiet:
+            output.failure(f"Could not read the plan: {exc}")
+        output.flush()
+        return False
+    if applier.resumed and not args_.quiet:
+        output.message(f"Resuming {applier.path}, {applier.resumed} "
+                       "operations were applied before.")
+    throttle = open_throttle(config.throttle_settings)
+    executor = cli_executor(config, args_, output, stats,
+                            completed_function=applier.completed,
+                            throttle=throttle)
+    try:
+        file_val = executor.execute(applier.operations())
+    except (OSError, ValueError) as exc:
+        applier.close(succeeded=False)
+        if not args_.quiet:
+            output.failure(f"Could not apply the plan: {exc}")
+        output.flush()
+        return False
+    applier.close(succeeded=not executor.errors)
+    if not args_.quiet:
+        for operation, exc in executor.errors:
+            output.failure(describe_failure(operation, exc))
+        output.message(f"Processed {file_val} files, skipped "
+                       f"{applier.changed} entries that changed since "
+                       "planning.")
+        if throttle is not None:
+            output.message(throttle.report())
+    if stats is not None:
+        stats.finish()
+        output.stats(stats, as_json=args_.stats == "json")
+    output.flush()
+    return not executor.errors
+
+
+def watch_folders_cli(config: Config, args_: argparse.Namespace,
+                      output: Optional[OutputSink] = None) -> bool:
+    """Organizes entries of the folders as they change until interrupted.
+    Returns whether every operation succeeded."""
+    from watch import FolderWatch
+
+    if output is None:
+        output = open_output(args_)
+    # Changes are reported as they are handled, not when the next one is.
+    output.flush()
+    output.flush_interval = 0.0
+    throttle = open_throttle(config.throttle_settings)
+    executor = cli_executor(config, args_, output, throttle=throttle)
+    watch = FolderWatch(config, args_, executor,
+                        update_function=output.message,
+                        debounce=args_.debounce,
+                        poll_interval=args_.poll_interval,
+                        polling=args_.polling)
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        pass
+    if not args_.quiet:
+        output.message(f"Processed {watch.handled} files while watching.")
+        if throttle is not None:
+            output.message(throttle.report())
+    output.flush()
+    return not watch.failed
 
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+
+        # Worker processes of -P start the executable of a PyInstaller
+        # build again, this makes them run the worker instead of main.
+        multiprocessing.freeze_support()
     main()
@@ -0,0 +1,174 @@
+"""Output sinks for the messages of MyOrganizer CLI runs and the batching
+shared with the GUI and the worker processes"""
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, TextIO
+import json
+import sys
+import threading
+import time
+
+from pipeline import Delete, Ignore, MakeDir, Move, Operation, Trash, describe_operation
+
+if TYPE_CHECKING:
+    from stats import RunStats
+
+OUTPUT_FORMATS = ("text", "jsonl", "summary")
+# Seconds lines are collected before they are written.
+FLUSH_INTERVAL = 0.5
+# Characters collected before they are written regardless of the interval.
+BUFFER_LIMIT = 64 * 1024
+# Seconds between batches of messages and progress sent to the window or
+# from a worker process to its parent.
+BATCH_INTERVAL = 0.05
+
+
+def operation_event(operation: Operation) -> Dict[str, Any]:
+    """Returns the JSON Lines event of an operation."""
+    match operation:
+        case Ignore(file):
+            return {"event": "ignore", "source": str(file)}
+        case Delete(file):
+            return {"event": "delete", "source": str(file)}
+        case Trash(file):
+            return {"event": "trash", "source": str(file)}
+        case MakeDir(path):
+            return {"event": "mkdir", "path": str(path)}
+        case Move(file, destination, _):
+            return {"event": "move", "source": str(file),
+                    "destination": str(destination)}
+    raise ValueError(f"Unknown operation {operation!r}")
+
+
+class Batcher:
+    """Passes output collected on several threads on in batches, at most
+    every flush_interval seconds, so the receiver gets one call per batch
+    instead of one per file. An interval of 0 passes every batch on right
+    away.
+
+    The owner adds to its buffers while holding lock. send_function
+    passes the buffers on and clears them, it is called with the lock
+    held so batches leave in the order they were collected."""
+
+    def __init__(self, send_function: Callable[[], None],
+                 flush_interval: float = BATCH_INTERVAL) -> None:
+        self.send_function = send_function
+        self.flush_interval = max(0.0, flush_interval)
+        self.lock = threading.Lock()
+        self.__last_flush: float = 0.0
+
+    def flush(self, force: bool = False) -> None:
+        """Passes the buffers on when the interval has passed since the
+        last batch, or right away with force."""
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.__last_flush < self.flush_interval:
+                return
+            self.__last_flush = now
+            self.send_function()
+
+
+class OutputSink:
+    """Writes the messages and operations of a run as text lines.
+
+    Lines are collected and written at most every flush_interval seconds,
+    or once BUFFER_LIMIT characters are waiting, so a slow terminal or
+    pipe costs one write per batch instead of one per file. An interval
+    of 0 writes every line right away."""
+
+    def __init__(self, stream: Optional[TextIO] = None,
+                 flush_interval: float = FLUSH_INTERVAL) -> None:
+        self.stream = stream if stream is not None else sys.stdout
+        # Operations can be reported from the executor's threads.
+        self.__batcher = Batcher(self.__write, flush_interval)
+        self.__lines: List[str] = []
+        self.__size: int = 0
+
+    @property
+    def flush_interval(self) -> float:
+        """Seconds lines are collected before they are written."""
+        return self.__batcher.flush_interval
+
+    @flush_interval.setter
+    def flush_interval(self, flush_interval: float) -> None:
+        self.__batcher.flush_interval = max(0.0, flush_interval)
+
+    def write(self, line: str) -> None:
+        """Adds a line to the buffer, writing it when it is due."""
+        with self.__batcher.lock:
+            self.__lines.append(line)
+            self.__size += len(line)
+            full = self.__size >= BUFFER_LIMIT
+        self.__batcher.flush(force=full)
+
+    def __write(self) -> None:
+        if self.__lines:
+            self.__lines.append("")
+            self.stream.write("\n".join(self.__lines))
+            self.stream.flush()
+            self.__lines = []
+            self.__size = 0
+
+    def flush(self) -> None:
+        """Writes the buffered lines."""
+        self.__batcher.flush(force=True)
+
+    def message(self, text: str) -> None:
+        """Reports a notice or a summary line."""
+        self.write(text)
+
+    def failure(self, text: str) -> None:
+        """Reports an operation that failed."""
+        self.write(text)
+
+    def operation(self, operation: Operation) -> None:
+        """Reports an operation as it is performed."""
+        text = describe_operation(operation)
+        if text is not None:
+            self.write(text)
+
+    def stats(self, stats: "RunStats", as_json: bool = False) -> None:
+        """Reports the statistics of the run."""
+        self.write(stats.format(as_json=as_json))
+
+    def close(self) -> None:
+        """Writes what is left in the buffer."""
+        self.flush()
+
+
+class JsonLinesSink(OutputSink):
+    """Writes one JSON object per event, operations with their paths."""
+
+    def __event(self, event: Dict[str, Any]) -> None:
+        self.write(json.dumps(event))
+
+    def message(self, text: str) -> None:
+        self.__event({"event": "message", "text": text})
+
+    def failure(self, text: str) -> None:
+        self.__event({"event": "error", "text": text})
+
+    def operation(self, operation: Operation) -> None:
+        self.__event(operation_event(operation))
+
+    def stats(self, stats: "RunStats", as_json: bool = False) -> None:
+        self.__event({"event": "stats", **stats.as_dict()})
+
+
+class SummarySink(OutputSink):
+    """Writes failures and the summary, leaving out every operation."""
+
+    def operation(self, operation: Operation) -> None:
+        pass
+
+
+def open_sink(output_format: str = "text",
+              flush_interval: float = FLUSH_INTERVAL,
+              stream: Optional[TextIO] = None) -> OutputSink:
+    """Returns the sink of an --output format."""
+    match output_format:
+        case "text":
+            return OutputSink(stream, flush_interval)
+        case "jsonl":
+            return JsonLinesSink(stream, flush_interval)
+        case "summary":
+            return SummarySink(stream, flush_interval)
+    raise ValueError(f"Unknown output format {output_format!r}")
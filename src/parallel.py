@@ -0,0 +1,222 @@
+"""Organizing configured folders in worker processes used by MyOrganizer"""
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+import argparse
+import multiprocessing
+import queue
+
+from config import Config
+from output import BATCH_INTERVAL, Batcher
+from pipeline import Executor, Operation, RunContext, describe_failure
+from scanner import FolderSnapshot
+from throttle import open_throttle
+
+if TYPE_CHECKING:
+    from stats import RunStats
+    from throttle import Throttle
+
+# Events a worker can queue before it waits for the parent.
+QUEUE_SIZE = 1000
+
+
+class FolderRun(NamedTuple):
+    """What organizing a configured folder in a worker process did."""
+    folder: Path
+    handled: int
+    scanned: int
+    failures: List[str]
+    skipped: int
+    recorded: int
+    stats: Optional["RunStats"]
+    throttle: Optional["Throttle"]
+
+
+# Set in every worker process by _init_worker.
+_events: Any = None
+_config_file: Optional[str] = None
+_args: Optional[argparse.Namespace] = None
+_report_operations: bool = False
+_workers: int = 1
+
+
+def _init_worker(events: Any, config_file: str, args_: argparse.Namespace,
+                 report_operations: bool, workers: int) -> None:
+    global _events, _config_file, _args, _report_operations, _workers
+    _events = events
+    _config_file = config_file
+    _args = args_
+    _report_operations = report_operations
+    _workers = workers
+
+
+class _Reporter:
+    """Collects the messages, operations and the progress of a worker and
+    sends them to the parent at most every BATCH_INTERVAL seconds."""
+
+    def __init__(self, number: int, events: Any) -> None:
+        self.number = number
+        self.events = events
+        # Messages come from the executor's threads.
+        self.__batcher = Batcher(self.__send)
+        self.__messages: List[Union[str, Operation]] = []
+        self.__base: int = 0
+        self.__handled: int = 0
+        self.__total: int = 0
+        self.__changed: bool = False
+
+    def add_text(self, text: str) -> None:
+        with self.__batcher.lock:
+            self.__messages.append(text)
+        self.flush()
+
+    def add_operation(self, operation: Operation) -> None:
+        with self.__batcher.lock:
+            self.__messages.append(operation)
+        self.flush()
+
+    def file_done(self, handled: int) -> None:
+        with self.__batcher.lock:
+            self.__handled = self.__base + handled
+            self.__changed = True
+        self.flush()
+
+    def begin_snapshot(self, snapshot: FolderSnapshot) -> None:
+        with self.__batcher.lock:
+            self.__base = self.__handled
+            self.__total += len(snapshot)
+            self.__changed = True
+        self.flush(force=True)
+
+    def flush(self, force: bool = False) -> None:
+        self.__batcher.flush(force)
+
+    def __send(self) -> None:
+        if self.__messages:
+            self.events.put(("messages", self.number, self.__messages))
+            self.__messages = []
+        if self.__changed:
+            self.events.put(("progress", self.number, self.__handled,
+                             self.__total))
+            self.__changed = False
+
+
+def _organize_folder(number: int, folder: Path) -> FolderRun:
+    """Organizes a configured folder in a worker process."""
+    assert _config_file is not None and _args is not None
+    args_ = _args
+    config = Config(_config_file)
+    stats = None
+    if getattr(args_, "stats", None):
+        from stats import RunStats
+
+        stats = RunStats()
+    reporter = _Reporter(number, _events)
+    # The workers running at the same time split the limits.
+    throttle = open_throttle(config.throttle_settings, _workers)
+    # Copy progress of several workers can not share a line, it is left
+    # out.
+    executor = Executor(args_, update_function=reporter.add_text,
+                        progress_function=reporter.file_done,
+                        jobs=getattr(args_, "jobs", 1),
+                        batch_size=config.settings.get("batch-size", 100),
+                        stats=stats,
+                        operation_function=reporter.add_operation
+                        if _report_operations else None,
+                        throttle=throttle)
+    context = RunContext(config, args_, stats, plan_out=False)
+    try:
+        handled, scanned = context.organize(folder, executor,
+                                            reporter.begin_snapshot)
+    finally:
+        context.close()
+        reporter.flush(force=True)
+        # The result is returned through another pipe, the parent waits
+        # for this event so no message of the folder arrives after it.
+        _events.put(("done", number))
+    return FolderRun(
+        folder=folder, handled=handled, scanned=scanned,
+        failures=[describe_failure(operation, exc)
+                  for operation, exc in executor.errors],
+        skipped=context.state.skipped if context.state is not None else 0,
+        recorded=context.state.recorded if context.state is not None else 0,
+        stats=stats, throttle=throttle)
+
+
+def organize_in_processes(
+        args_: argparse.Namespace, folders: List[Path],
+        processes: int, update_function: Callable[[str], None],
+        progress_function: Optional[Callable[[int, int], None]] = None,
+        folder_function: Optional[Callable[[FolderRun], None]] = None,
+        operation_function: Optional[Callable[[Operation], None]] = None
+        ) -> List[FolderRun]:
+    """Organizes every folder in its own worker process, at most processes
+    of them at a time. Messages of the workers are passed to
+    update_function and their progress, summed over the folders, to
+    progress_function as entries handled and entries found so far.
+    folder_function is called with every folder that is done. With
+    operation_function, workers send the operations they report instead
+    of their messages, like Executor does. Returns
+    the runs in the order of folders, a worker that failed as a whole
+    reports the failure and handled nothing."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Spawned workers don't inherit the locks and threads of the parent.
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue(maxsize=QUEUE_SIZE)
+    progress: Dict[int, Tuple[int, int]] = {}
+    runs: Dict[int, FolderRun] = {}
+    finished: Set[int] = set()
+
+    def dispatch(event: Tuple[Any, ...]) -> None:
+        match event:
+            case ("messages", _, messages):
+                for message in messages:
+                    if isinstance(message, str):
+                        update_function(message)
+                    elif operation_function is not None:
+                        operation_function(message)
+            case ("progress", number, handled, total):
+                progress[number] = (handled, total)
+                if progress_function is not None:
+                    progress_function(
+                        sum(value[0] for value in progress.values()),
+                        sum(value[1] for value in progress.values()))
+            case ("done", number):
+                finished.add(number)
+
+    def drain(timeout: Optional[float]) -> None:
+        try:
+            dispatch(events.get(timeout=timeout))
+            while True:
+                dispatch(events.get_nowait())
+        except queue.Empty:
+            pass
+
+    workers = max(1, min(processes, len(folders)))
+    with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=_init_worker,
+            initargs=(events, str(args_.config), args_,
+                      operation_function is not None, workers)) as pool:
+        pending = {pool.submit(_organize_folder, number, folder): number
+                   for number, folder in enumerate(folders)}
+        while pending:
+            drain(BATCH_INTERVAL)
+            for future in [future for future in pending if future.done()]:
+                number = pending[future]
+                exc = future.exception()
+                if exc is None and number not in finished:
+                    # Its last events are still on the way.
+                    continue
+                del pending[future]
+                if exc is not None:
+                    run = FolderRun(folders[number], 0, 0,
+                                    [f"Could not organize {folders[number]}: "
+                                     f"{exc}"], 0, 0, None, None)
+                else:
+                    run = future.result()
+                runs[number] = run
+                if folder_function is not None:
+                    folder_function(run)
+    events.close()
+    return [runs[number] for number in range(len(folders))]
@@ -0,0 +1,242 @@
+"""Pattern rules matching names, sizes and ages, used by MyOrganizer"""
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+import fnmatch
+import re
+import time
+
+from scanner import ScanEntry
+
+SIZE_UNITS: Dict[str, int] = {"": 1, "b": 1, "k": 1024, "kb": 1024,
+                              "kib": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+                              "mib": 1024 ** 2, "g": 1024 ** 3,
+                              "gb": 1024 ** 3, "gib": 1024 ** 3,
+                              "t": 1024 ** 4, "tb": 1024 ** 4,
+                              "tib": 1024 ** 4}
+AGE_UNITS: Dict[str, int] = {"": 1, "s": 1, "m": 60, "h": 3600,
+                             "d": 86400, "w": 604800, "min": 60,
+                             "hour": 3600, "hours": 3600, "day": 86400,
+                             "days": 86400, "week": 604800,
+                             "weeks": 604800}
+KEYS = frozenset({"glob", "regex", "ignore-case", "larger-than",
+                  "smaller-than", "older-than", "newer-than", "folder"})
+
+_QUANTITY = re.compile(r"\s*(\d+(?:\.\d*)?)\s*([a-zA-Z]*)\s*")
+# Groups fnmatch.translate uses internally.
+_GLOB_GROUP = re.compile(r"\(\?P([<=])(\w+)")
+_GLOB_SPECIAL = re.compile(r"[*?\[\]]")
+
+
+def _parse_quantity(value: Any, units: Dict[str, int], what: str) -> float:
+    """Parses numbers like 10, "1.5G" or "30d" into base units."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _QUANTITY.fullmatch(str(value))
+    if match is None or match.group(2).lower() not in units:
+        raise ValueError(f"{value!r} is not a valid {what}")
+    return float(match.group(1)) * units[match.group(2).lower()]
+
+
+def parse_size(value: Any) -> int:
+    """Parses a size in bytes, 1K is 1024 bytes."""
+    return int(_parse_quantity(value, SIZE_UNITS, "size"))
+
+
+def parse_age(value: Any) -> float:
+    """Parses an age in seconds, units are s, m, h, d and w."""
+    return _parse_quantity(value, AGE_UNITS, "age")
+
+
+def name_suffix(name: str) -> Optional[str]:
+    """Lowercased last suffix of a name, including the dot."""
+    dot = name.rfind(".")
+    return name[dot:].lower() if dot != -1 else None
+
+
+def glob_suffix(glob: str) -> Optional[str]:
+    """Lowercased suffix every name matching the glob ends with, if the
+    glob ends with a literal one."""
+    return name_suffix(_GLOB_SPECIAL.split(glob)[-1])
+
+
+class PatternRule(NamedTuple):
+    """A rule of pattern-rules. Every given condition has to hold."""
+    folder: str
+    name: Optional[Pattern[str]]
+    glob: bool
+    suffix: Optional[str]
+    min_size: Optional[int]
+    max_size: Optional[int]
+    min_age: Optional[float]
+    max_age: Optional[float]
+
+    @classmethod
+    def parse(cls, rule: Dict[str, Any]) -> "PatternRule":
+        """Parses and validates a rule of the config file."""
+        if not isinstance(rule, dict):
+            raise ValueError(f"{rule!r} is not an object")
+        unknown = set(rule) - KEYS
+        if unknown:
+            raise ValueError(f"unknown keys {', '.join(sorted(unknown))}")
+        if not isinstance(rule.get("folder"), str) or not rule["folder"]:
+            raise ValueError(f"{rule!r} has no folder")
+        if "glob" in rule and "regex" in rule:
+            raise ValueError(f"{rule!r} has both glob and regex")
+
+        source: Optional[str] = None
+        if "glob" in rule:
+            source = fnmatch.translate(str(rule["glob"]))
+        elif "regex" in rule:
+            source = str(rule["regex"])
+        name: Optional[Pattern[str]] = None
+        if source is not None:
+            flags = re.DOTALL | (re.IGNORECASE if rule.get("ignore-case")
+                                 else 0)
+            try:
+                name = re.compile(source, flags)
+            except re.error as exc:
+                raise ValueError(f"{source!r}: {exc}") from exc
+
+        return cls(
+            folder=rule["folder"],
+            name=name,
+            glob="glob" in rule,
+            suffix=glob_suffix(str(rule["glob"])) if "glob" in rule else None,
+            min_size=(parse_size(rule["larger-than"])
+                      if "larger-than" in rule else None),
+            max_size=(parse_size(rule["smaller-than"])
+                      if "smaller-than" in rule else None),
+            min_age=(parse_age(rule["older-than"])
+                     if "older-than" in rule else None),
+            max_age=(parse_age(rule["newer-than"])
+                     if "newer-than" in rule else None),
+        )
+
+    @property
+    def has_predicates(self) -> bool:
+        """Whether the rule looks at the size or the age."""
+        return not (self.min_size is None and self.max_size is None
+                    and self.min_age is None and self.max_age is None)
+
+    def predicates_match(self, file: ScanEntry) -> bool:
+        """Whether size and age of the entry satisfy the rule."""
+        if not self.has_predicates:
+            return True
+        if file.stat is None:
+            return False
+        size = file.stat.st_size
+        if self.min_size is not None and size <= self.min_size:
+            return False
+        if self.max_size is not None and size >= self.max_size:
+            return False
+        if self.min_age is not None or self.max_age is not None:
+            age = time.time() - file.stat.st_mtime
+            if self.min_age is not None and age <= self.min_age:
+                return False
+            if self.max_age is not None and age >= self.max_age:
+                return False
+        return True
+
+
+class PatternMatcher:
+    """Ordered pattern rules, the first matching one wins.
+
+    Globs and regexes without groups of their own are joined into
+    alternations, so one regex match finds the first rule whose name
+    matches. Python tries alternatives one after another, so globs ending
+    with a literal suffix such as *.png only take part in the alternation
+    used for names with that suffix. Only rules without a name pattern
+    and regexes that can not be embedded, such as ones with groups whose
+    numbering would break, are checked one by one."""
+
+    def __init__(self, rules: List[PatternRule]) -> None:
+        self.rules = rules
+        self.folders = frozenset(rule.folder for rule in rules)
+        self.__group_positions: Dict[str, int] = {}
+        # Positions of rules that are not part of the alternations.
+        self.__separate: List[int] = []
+        self.__alternatives: List[Tuple[Optional[str], str]] = []
+        self.__names: Dict[Optional[str], Optional[Pattern[str]]] = {}
+        for position, rule in enumerate(rules):
+            if rule.name is None or (rule.name.groups and not rule.glob):
+                self.__separate.append(position)
+                continue
+            group = f"rule{position}"
+            source = rule.name.pattern
+            if rule.glob:
+                # Keep the names of the groups of every glob apart.
+                source = _GLOB_GROUP.sub(
+                    lambda match: f"(?P{match[1]}{group}_{match[2]}",
+                    source)
+            flags = "is" if rule.name.flags & re.IGNORECASE else "s"
+            alternative = f"(?P<{group}>(?{flags}:{source})\\Z)"
+            try:
+                re.compile(alternative)
+            except re.error:
+                # Global inline flags and the like.
+                self.__separate.append(position)
+                continue
+            self.__group_positions[group] = position
+            self.__alternatives.append((rule.suffix, alternative))
+        self.__suffixes = frozenset(suffix for suffix, _
+                                    in self.__alternatives if suffix)
+
+    def __names_for(self, suffix: Optional[str]) -> Optional[Pattern[str]]:
+        """Alternation of the rules a name with the suffix can match."""
+        if suffix not in self.__suffixes:
+            suffix = None
+        if suffix not in self.__names:
+            alternatives = [alternative for rule_suffix, alternative
+                            in self.__alternatives
+                            if rule_suffix is None or rule_suffix == suffix]
+            self.__names[suffix] = (re.compile("|".join(alternatives))
+                                    if alternatives else None)
+        return self.__names[suffix]
+
+    @classmethod
+    def compile(cls, rules: List[Dict[str, Any]]) -> "PatternMatcher":
+        """Compiles pattern-rules, raises ValueError for invalid rules."""
+        if not isinstance(rules, list):
+            raise ValueError("pattern-rules has to be a list")
+        parsed: List[PatternRule] = []
+        for number, rule in enumerate(rules, 1):
+            try:
+                parsed.append(PatternRule.parse(rule))
+            except ValueError as exc:
+                raise ValueError(f"rule {number}: {exc}") from exc
+        return cls(parsed)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    @property
+    def uses_age(self) -> bool:
+        """Whether a rule can match an unchanged file later on."""
+        return any(rule.min_age is not None or rule.max_age is not None
+                   for rule in self.rules)
+
+    def __check(self, position: int, file: ScanEntry) -> bool:
+        rule = self.rules[position]
+        return ((rule.name is None or rule.name.fullmatch(file.name)
+                 is not None) and rule.predicates_match(file))
+
+    def match(self, file: ScanEntry) -> Optional[str]:
+        """Returns the folder of the first rule matching the entry."""
+        names = self.__names_for(name_suffix(file.name))
+        found = names.match(file.name) if names is not None else None
+        first = (self.__group_positions[found.lastgroup]
+                 if found is not None and found.lastgroup is not None
+                 else len(self.rules))
+        for position in self.__separate:
+            if position > first:
+                break
+            if self.__check(position, file):
+                return self.rules[position].folder
+        if found is None:
+            return None
+        if self.rules[first].predicates_match(file):
+            return self.rules[first].folder
+        # The first rule matching the name rejected the size or age.
+        for position in range(first + 1, len(self.rules)):
+            if self.__check(position, file):
+                return self.rules[position].folder
+        return None
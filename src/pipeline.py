@@ -0,0 +1,700 @@
+"""Plan and execute stages shared by the MyOrganizer front ends"""
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union, TYPE_CHECKING
+import argparse
+import fnmatch
+import os
+import time
+
+from config import Config
+from rules import Rules
+from scanner import FolderSnapshot, ScanEntry, name_suffixes, scan_folder, walk_folder
+from transfer import ProgressFunction, move_file
+
+if TYPE_CHECKING:
+    from duplicates import DuplicateFinder
+    from plan import PlanWriter
+    from sniff import ContentSniffer
+    from state import StateStore
+    from stats import RunStats
+    from throttle import Throttle
+
+
+class Ignore(NamedTuple):
+    """Leave the entry where it is."""
+    source: ScanEntry
+
+
+class Delete(NamedTuple):
+    """Delete the entry."""
+    source: ScanEntry
+
+
+class Trash(NamedTuple):
+    """Send the entry to the trash bin."""
+    source: ScanEntry
+
+
+class MakeDir(NamedTuple):
+    """Create a destination folder."""
+    path: Path
+
+
+class Move(NamedTuple):
+    """Move the entry to the destination path. same_device is None when
+    it is not known whether both are on the same filesystem."""
+    source: ScanEntry
+    destination: Path
+    same_device: Optional[bool] = None
+
+
+Operation = Union[Ignore, Delete, Trash, MakeDir, Move]
+
+
+def resolve_folder(folder: str) -> Path:
+    """Returns the path of a folder listed in folders-to-organize."""
+    if folder.startswith("$"):
+        folder = folder.replace("$HOME", str(Path.home()))
+    return Path(folder)
+
+
+def iter_folders(config: Config) -> Iterator[Tuple[str, Path]]:
+    """Yields the folders to organize with their resolved paths."""
+    for folder in config.folders_to_organize:
+        yield folder, resolve_folder(folder)
+
+
+def missing_folder_message(folder_path: Path) -> str:
+    """Returns the message reporting a folder to organize that does not
+    exist."""
+    return (f"Folder {folder_path.resolve()} does not exist. Please "
+            "double-check the path.")
+
+
+def existing_folders(config: Config,
+                     missing_function: Optional[Callable[[Path], None]]
+                     = None) -> Iterator[Tuple[str, Path]]:
+    """Yields the folders to organize that exist with their resolved
+    paths. missing_function is called with the path of every other
+    one."""
+    for folder, folder_path in iter_folders(config):
+        if folder_path.exists():
+            yield folder, folder_path
+        elif missing_function is not None:
+            missing_function(folder_path)
+
+
+def iter_snapshots(folder_path: Path, rules: Rules,
+                   args_: argparse.Namespace,
+                   removed: Optional[Set[Path]] = None
+                   ) -> Iterator[FolderSnapshot]:
+    """Yields the snapshot of a folder to organize. Recursive runs go on
+    with its subfolders down to args_.max_depth, leaving out destination
+    folders, those matching an args_.exclude glob by name or by path
+    relative to folder_path and those in removed, which the plan moves
+    or deletes even when a dry run leaves them in place. Every subfolder
+    is organized on its own."""
+    if not getattr(args_, "recursive", False):
+        yield scan_folder(folder_path)
+        return
+    max_depth: Optional[int] = getattr(args_, "max_depth", None)
+    exclude: List[str] = getattr(args_, "exclude", None) or []
+
+    def descend(entry: ScanEntry, depth: int) -> bool:
+        if max_depth is not None and depth > max_depth:
+            return False
+        if entry.name in rules.destinations:
+            return False
+        if removed is not None and entry.path in removed:
+            return False
+        relative = entry.path.relative_to(folder_path).as_posix()
+        return not any(fnmatch.fnmatch(entry.name, pattern)
+                       or fnmatch.fnmatch(relative, pattern)
+                       for pattern in exclude)
+
+    yield from walk_folder(folder_path, descend)
+
+
+class DestinationIndex:
+    """Names in destination folders, listed once and updated as moves are
+    planned so that free names are found without touching the disk."""
+
+    def __init__(self) -> None:
+        self.__names: Dict[Path, Set[str]] = {}
+        self.__counters: Dict[Tuple[Path, str], int] = {}
+        self.__devices: Dict[Path, Optional[int]] = {}
+        self.__folders: Dict[Tuple[Path | str, str], Path] = {}
+        self.syscalls: int = 0
+
+    def folder(self, parent_folder: Path | str, folder_name: str) -> Path:
+        """Returns the path of a destination folder, built once."""
+        folder = self.__folders.get((parent_folder, folder_name))
+        if folder is None:
+            folder = self.__folders[(parent_folder, folder_name)] = Path(
+                parent_folder).joinpath(folder_name)
+        return folder
+
+    def is_listed(self, folder: Path) -> bool:
+        """Whether the folder has already been used as a destination."""
+        return folder in self.__names
+
+    def names(self, folder: Path) -> Set[str]:
+        """Returns the normcased names in the folder, listing it once."""
+        names = self.__names.get(folder)
+        if names is None:
+            self.syscalls += 1
+            try:
+                names = {os.path.normcase(name)
+                         for name in os.listdir(folder)}
+            except OSError:
+                names = set()
+            self.__names[folder] = names
+        return names
+
+    def device(self, folder: Path) -> Optional[int]:
+        """Returns st_dev of the folder, or of its closest existing parent
+        when it is yet to be created."""
+        if folder not in self.__devices:
+            device: Optional[int] = None
+            for path in (folder, *folder.parents):
+                self.syscalls += 1
+                try:
+                    device = os.stat(path).st_dev
+                    break
+                except OSError:
+                    continue
+            self.__devices[folder] = device
+        return self.__devices[folder]
+
+    def same_device(self, file: ScanEntry, folder: Path) -> Optional[bool]:
+        """Whether the entry can be renamed into the folder."""
+        if file.stat is None or file.is_symlink:
+            return None
+        device = self.device(folder)
+        if device is None:
+            return None
+        return file.stat.st_dev == device
+
+    def allocate(self, folder: Path, name: str) -> Path:
+        """Returns a free path for name in the folder and reserves it.
+        Taken names get the first free (i) counter before their
+        suffixes, as in photo(1).tar.gz."""
+        names = self.names(folder)
+        if os.path.normcase(name) not in names:
+            names.add(os.path.normcase(name))
+            return folder.joinpath(name)
+
+        suffix = "".join(name_suffixes(name))
+        stem = name[:len(name) - len(suffix)]
+        i = self.__counters.get((folder, name), 1)
+        candidate = f"{stem}({i}){suffix}"
+        while os.path.normcase(candidate) in names:
+            i += 1
+            candidate = f"{stem}({i}){suffix}"
+        self.__counters[(folder, name)] = i + 1
+        names.add(os.path.normcase(candidate))
+        return folder.joinpath(candidate)
+
+
+def plan_entry(file: ScanEntry, parent_folder: Path | str, folder_name: str,
+               destinations: DestinationIndex) -> Iterator[Operation]:
+    """Yields the operations needed to handle a classified entry."""
+    if folder_name.startswith("!"):
+        match folder_name:
+            case "!ignore":
+                yield Ignore(file)
+                return
+            case "!delete":
+                yield Delete(file)
+                return
+            case "!movetotrash":
+                yield Trash(file)
+                return
+
+    destination_folder = destinations.folder(parent_folder, folder_name)
+    if not destinations.is_listed(destination_folder):
+        yield MakeDir(destination_folder)
+    yield Move(file, destinations.allocate(destination_folder, file.name),
+               destinations.same_device(file, destination_folder))
+
+
+def _note_removed(operations: Iterable[Operation], removed: Set[Path]
+                  ) -> Iterator[Operation]:
+    """Passes the operations on, adding the directories they move or
+    delete to removed."""
+    for operation in operations:
+        if (isinstance(operation, (Move, Delete, Trash))
+                and operation.source.is_dir
+                and not operation.source.is_symlink):
+            removed.add(operation.source.path)
+        yield operation
+
+
+def _with_independence(classified: Iterable[Tuple[ScanEntry, str]],
+                       snapshot: FolderSnapshot
+                       ) -> Iterator[Tuple[ScanEntry, str, bool]]:
+    """Adds to every classified entry whether its folder name was found
+    without looking up a sibling, counted as each entry is classified."""
+    index = snapshot.name_index()
+    lookups = index.lookups
+    for file, folder_name in classified:
+        yield file, folder_name, index.lookups == lookups
+        lookups = index.lookups
+
+
+def plan_folder(snapshot: FolderSnapshot, rules: Rules,
+                args_: argparse.Namespace,
+                destinations: Optional[DestinationIndex] = None,
+                state: Optional["StateStore"] = None,
+                only: Optional[Set[str]] = None,
+                stats: Optional["RunStats"] = None,
+                duplicates: Optional["DuplicateFinder"] = None,
+                sniffer: Optional["ContentSniffer"] = None
+                ) -> Iterator[Operation]:
+    """Classifies the entries of a snapshot and yields the operations.
+    With a state store, entries it knows to be ignored are skipped and
+    the new results are recorded in it. only limits the run to the
+    entries with those names. stats receives the classification time and
+    the number of entries per destination. With a duplicate finder and a
+    duplicates special type, entries about to be moved that duplicate
+    another file get that folder name instead. With sniff-content, the
+    headers of files without a known suffix are read by sniffer, or by
+    an uncached one if none is given, before classification."""
+    if destinations is None:
+        destinations = DestinationIndex()
+    syscalls = destinations.syscalls
+    if state is not None:
+        state.begin_folder(snapshot.folder)
+    # Results of age rules expire, so nothing is skipped with them.
+    known = (state.known if state is not None and not rules.time_dependent
+             else None)
+    content_type = None
+    if rules.sniff_content:
+        if sniffer is None:
+            from sniff import ContentSniffer
+
+            sniffer = ContentSniffer()
+        start = time.perf_counter()
+        read = sniffer.read
+        sniffer.prefetch(file for file in snapshot
+                         if (only is None or file.name in only)
+                         and rules.match_suffixes(file.suffixes) is None)
+        if stats is not None:
+            stats.add("sniff", time.perf_counter() - start,
+                      f"sniff {snapshot.folder}", count=sniffer.read - read)
+        content_type = sniffer.content_type
+    classified: Iterable[Tuple[ScanEntry, str]] = rules.classify(
+        snapshot, args_, known, only, content_type)
+    if stats is not None:
+        classified = stats.timed("classify", classified)
+    results: Iterable[Tuple[ScanEntry, str, bool]] = _with_independence(
+        classified, snapshot)
+    if duplicates is not None and rules.duplicates is not None:
+        results = list(results)
+        start = time.perf_counter()
+        found = duplicates.find_in_folder(
+            snapshot.folder,
+            [(file, folder_name) for file, folder_name, _ in results])
+        if stats is not None:
+            stats.add("hash", time.perf_counter() - start,
+                      f"compare {snapshot.folder}")
+        results = [(file, rules.duplicates if file in found else folder_name,
+                    independent)
+                   for file, folder_name, independent in results]
+
+    for file, folder_name, independent in results:
+        if state is not None:
+            state.record(file, folder_name, independent=independent)
+        if stats is not None:
+            stats.count(folder_name)
+        yield from plan_entry(file, snapshot.folder, folder_name,
+                              destinations)
+    if stats is not None:
+        stats.syscalls["destinations"] += destinations.syscalls - syscalls
+
+
+def describe_operation(operation: Operation) -> Optional[str]:
+    """Returns the message reporting an operation, None for folders that
+    are created."""
+    match operation:
+        case Ignore(file):
+            return f"Ignoring {file}"
+        case Delete(file):
+            return f"Deleting {file}"
+        case Trash(file):
+            return f"Sending {file} to trash"
+        case Move(file, destination, _):
+            return f"Moving {file}\nDestination: {destination}"
+    return None
+
+
+def describe_failure(operation: Operation, exc: OSError) -> str:
+    """Returns a message describing a failed operation."""
+    match operation:
+        case Delete(file):
+            action = f"delete {file}"
+        case Trash(file):
+            action = f"send {file} to trash"
+        case MakeDir(path):
+            action = f"create {path}"
+        case Move(file, destination, _):
+            action = f"move {file} to {destination}"
+        case _:
+            action = f"handle {operation.source}"
+    return f"Could not {action}: {exc}"
+
+
+class Executor:
+    """Performs planned operations, serially or on a thread pool.
+
+    Destination folders are created by the calling thread in plan order,
+    only the moves, deletions and trash operations themselves run on the
+    pool. Deletions and trash operations are queued and performed in
+    batches of batch_size, the queues are flushed at the end of every
+    execute call. Failed operations are collected in errors instead of
+    stopping the run. With stats, the duration of every operation is
+    added to its phase. completed_function is called with every
+    operation that succeeded, deletions and trash operations once their
+    batch ran, possibly on a pool thread. operation_function, when given,
+    is called with every operation to report instead of passing its
+    message to update_function. With throttle, every operation waits
+    for its limits before it is reported and copies across filesystems
+    wait for their bytes."""
+
+    def __init__(self, args_: argparse.Namespace,
+                 update_function: Callable[[str], None],
+                 progress_function: Optional[Callable[[int], None]] = None,
+                 jobs: int = 1,
+                 byte_progress_function: Optional[ProgressFunction] = None,
+                 batch_size: int = 100,
+                 stats: Optional["RunStats"] = None,
+                 completed_function: Optional[Callable[[Operation], None]]
+                 = None,
+                 operation_function: Optional[Callable[[Operation], None]]
+                 = None,
+                 throttle: Optional["Throttle"] = None) -> None:
+        self.args_ = args_
+        self.stats = stats
+        self.throttle = throttle
+        self.completed_function = completed_function
+        self.operation_function = operation_function
+        self.update_function = update_function
+        self.progress_function = progress_function
+        self.byte_progress_function = byte_progress_function
+        self.jobs: int = max(1, jobs)
+        self.batch_size: int = max(1, batch_size)
+        self.errors: List[Tuple[Operation, OSError]] = []
+        self.__deletions: List[Delete] = []
+        self.__trash: List[Trash] = []
+
+    def execute(self, operations: Iterable[Operation]) -> int:
+        """Performs the operations, returns the number of entries handled."""
+        if self.jobs == 1:
+            handled = self.__execute_serial(operations)
+        else:
+            handled = self.__execute_parallel(operations)
+        for batch in (self.__deletions, self.__trash):
+            action = self.__flush(batch)
+            if action is not None:
+                action()
+        return handled
+
+    def __completed(self, operation: Operation) -> None:
+        # Queued deletions and trash operations complete with their batch.
+        if (self.completed_function is not None
+                and not isinstance(operation, (Delete, Trash))):
+            self.completed_function(operation)
+
+    def __batch_completed(self, operation: Operation) -> None:
+        if self.completed_function is not None:
+            self.completed_function(operation)
+
+    def __done(self, handled: int) -> None:
+        if self.progress_function is not None:
+            self.progress_function(handled)
+
+    def __execute_serial(self, operations: Iterable[Operation]) -> int:
+        handled = 0
+        for operation in operations:
+            try:
+                self.perform(operation)
+            except OSError as exc:
+                self.errors.append((operation, exc))
+            else:
+                self.__completed(operation)
+            if not isinstance(operation, MakeDir):
+                handled += 1
+                self.__done(handled)
+        return handled
+
+    def __execute_parallel(self, operations: Iterable[Operation]) -> int:
+        from concurrent.futures import (FIRST_COMPLETED, Future,
+                                        ThreadPoolExecutor, wait)
+
+        handled = 0
+        pending: Dict[Future, Operation] = {}
+
+        def collect(futures: Iterable[Future]) -> None:
+            nonlocal handled
+            for future in futures:
+                operation = pending.pop(future)
+                exc = future.exception()
+                if isinstance(exc, OSError):
+                    self.errors.append((operation, exc))
+                elif exc is not None:
+                    raise exc
+                else:
+                    self.__completed(operation)
+                handled += 1
+                self.__done(handled)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for operation in operations:
+                try:
+                    action = self.prepare(operation)
+                except OSError as exc:
+                    self.errors.append((operation, exc))
+                    action = None
+                else:
+                    if action is None:
+                        self.__completed(operation)
+                if isinstance(operation, MakeDir):
+                    continue
+                if action is None:
+                    handled += 1
+                    self.__done(handled)
+                    continue
+                pending[pool.submit(action)] = operation
+                if len(pending) >= self.jobs * 4:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(pending).done)
+        return handled
+
+    def perform(self, operation: Operation) -> None:
+        """Performs a single operation."""
+        action = self.prepare(operation)
+        if action is not None:
+            action()
+
+    def prepare(self, operation: Operation) -> Optional[Callable[[], object]]:
+        """Reports the operation and does the work that has to happen in
+        plan order. Returns the remaining I/O, if any."""
+        args_ = self.args_
+        if (self.throttle is not None and not args_.dry_run
+                and not isinstance(operation, Ignore)):
+            self.throttle.operation()
+        if not args_.quiet:
+            if self.operation_function is not None:
+                self.operation_function(operation)
+            else:
+                message = describe_operation(operation)
+                if message is not None:
+                    self.update_function(message)
+        match operation:
+            case Delete():
+                if not args_.dry_run:
+                    return self.__queue(self.__deletions, operation)
+            case Trash():
+                if not args_.dry_run:
+                    return self.__queue(self.__trash, operation)
+            case MakeDir(path):
+                if not args_.dry_run:
+                    self.__timed("mkdir", f"create {path}",
+                                 partial(path.mkdir, parents=True,
+                                         exist_ok=True))()
+            case Move(file, destination, same_device):
+                if not args_.dry_run:
+                    return self.__timed(
+                        "move", f"move {file} to {destination}",
+                        partial(self.__move, file, destination,
+                                same_device))
+        return None
+
+    def __timed(self, phase: str, description: str,
+                action: Callable[[], object], count: int = 1
+                ) -> Callable[[], object]:
+        """Wraps action so that its duration is added to stats."""
+        stats = self.stats
+        if stats is None:
+            return action
+
+        def timed() -> object:
+            start = time.perf_counter()
+            try:
+                return action()
+            finally:
+                stats.add(phase, time.perf_counter() - start, description,
+                          count)
+        return timed
+
+    def __move(self, file: ScanEntry, destination: Path,
+               same_device: Optional[bool]) -> None:
+        if self.throttle is None:
+            copied = move_file(file.path, destination, same_device,
+                               file.is_regular_file,
+                               self.byte_progress_function)
+        else:
+            copied = move_file(file.path, destination, same_device,
+                               file.is_regular_file,
+                               self.throttle.copy_progress(
+                                   self.byte_progress_function),
+                               self.throttle.chunk_size)
+        if self.stats is not None and file.is_regular_file:
+            assert file.stat is not None
+            self.stats.moved(file.stat.st_size, copied)
+
+    def __queue(self, batch: list, operation: Operation
+                ) -> Optional[Callable[[], object]]:
+        batch.append(operation)
+        if len(batch) >= self.batch_size:
+            return self.__flush(batch)
+        return None
+
+    def __flush(self, batch: list) -> Optional[Callable[[], object]]:
+        if not batch:
+            return None
+        operations = batch.copy()
+        batch.clear()
+        if isinstance(operations[0], Trash):
+            return self.__timed(
+                "trash", f"send {len(operations)} entries to trash",
+                partial(self.__trash_batch, operations), len(operations))
+        return self.__timed(
+            "delete", f"delete {len(operations)} entries",
+            partial(self.__delete_batch, operations), len(operations))
+
+    def __trash_batch(self, operations: List[Trash]) -> None:
+        from send2trash import send2trash
+
+        try:
+            send2trash([operation.source.path for operation in operations])
+        except OSError:
+            # Find out which entries are left and why.
+            for operation in operations:
+                if os.path.lexists(operation.source.path):
+                    try:
+                        send2trash(operation.source.path)
+                    except OSError as exc:
+                        self.errors.append((operation, exc))
+                        continue
+                self.__batch_completed(operation)
+        else:
+            for operation in operations:
+                self.__batch_completed(operation)
+
+    def __delete_batch(self, operations: List[Delete]) -> None:
+        folder = operations[0].source.path.parent
+        dir_fd: Optional[int] = None
+        if os.unlink in os.supports_dir_fd:
+            try:
+                dir_fd = os.open(folder, os.O_RDONLY)
+            except OSError:
+                pass
+        try:
+            for operation in operations:
+                path = operation.source.path
+                try:
+                    if dir_fd is not None and path.parent == folder:
+                        os.unlink(path.name, dir_fd=dir_fd)
+                    else:
+                        os.remove(path)
+                except OSError as exc:
+                    self.errors.append((operation, exc))
+                else:
+                    self.__batch_completed(operation)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+
+class RunContext:
+    """Rules and optional stages of a run, opened from the config and the
+    arguments: the incremental state, the plan file, the duplicate finder
+    and the content sniffer. organize runs a configured folder through
+    them. plan_out and incremental False leave the plan file and the
+    state closed even when the arguments ask for them."""
+
+    def __init__(self, config: Config, args_: argparse.Namespace,
+                 stats: Optional["RunStats"] = None,
+                 plan_out: bool = True, incremental: bool = True) -> None:
+        self.rules = config.compile_rules()
+        self.args_ = args_
+        self.stats = stats
+        jobs = getattr(args_, "jobs", 1)
+
+        self.state: Optional["StateStore"] = None
+        if incremental and getattr(args_, "incremental", False):
+            from state import StateStore, state_path
+
+            self.state = StateStore(state_path(args_.config),
+                                    config.digest())
+
+        self.plan: Optional["PlanWriter"] = None
+        if plan_out and getattr(args_, "plan_out", None) is not None:
+            from plan import PlanWriter
+
+            self.plan = PlanWriter(args_.plan_out, args_.config)
+
+        self.duplicates: Optional["DuplicateFinder"] = None
+        if self.rules.duplicates is not None:
+            from duplicates import DigestCache, DuplicateFinder, digest_path
+
+            self.duplicates = DuplicateFinder(
+                DigestCache(digest_path(args_.config)), jobs=jobs)
+
+        self.sniffer: Optional["ContentSniffer"] = None
+        if self.rules.sniff_content:
+            from sniff import ContentSniffer, ContentTypeCache, content_types_path
+
+            self.sniffer = ContentSniffer(
+                ContentTypeCache(content_types_path(args_.config)),
+                jobs=jobs)
+
+    def organize(self, folder_path: Path, executor: "Executor",
+                 snapshot_function: Optional[
+                     Callable[[FolderSnapshot], None]] = None
+                 ) -> Tuple[int, int]:
+        """Organizes a configured folder and, in recursive runs, its
+        subfolders. snapshot_function is called with every snapshot before
+        its entries are handled. Returns the number of entries handled and
+        of folders scanned."""
+        stats = self.stats
+        handled = 0
+        scanned = 0
+        recursive = getattr(self.args_, "recursive", False)
+        removed: Set[Path] = set()
+        snapshots = iter_snapshots(folder_path, self.rules, self.args_,
+                                   removed)
+        while True:
+            start = time.perf_counter()
+            snapshot = next(snapshots, None)
+            if snapshot is None:
+                break
+            scanned += 1
+            if stats is not None:
+                stats.add("scan", time.perf_counter() - start,
+                          f"scan {snapshot.folder}")
+                stats.syscalls["scan"] += snapshot.syscalls
+                stats.folders += 1
+            if snapshot_function is not None:
+                snapshot_function(snapshot)
+            operations = plan_folder(snapshot, self.rules, self.args_,
+                                     state=self.state, stats=stats,
+                                     duplicates=self.duplicates,
+                                     sniffer=self.sniffer)
+            if recursive:
+                operations = _note_removed(operations, removed)
+            if self.plan is not None:
+                operations = self.plan.record(operations)
+            handled += executor.execute(operations)
+            if self.state is not None:
+                self.state.finish_folder(snapshot)
+        return handled, scanned
+
+    def close(self) -> None:
+        """Closes the stages that were opened."""
+        for stage in (self.state, self.plan, self.duplicates, self.sniffer):
+            if stage is not None:
+                stage.close()
@@ -0,0 +1,215 @@
+"""Exported plans of MyOrganizer runs"""
+from pathlib import Path
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, Optional, Set, Tuple
+import json
+import os
+import stat
+import threading
+
+from pipeline import Delete, DestinationIndex, Ignore, MakeDir, Move, Operation, Trash
+from scanner import IS_DIR, IS_SYMLINK, READABLE, WRITABLE, EntryStat, ScanEntry
+
+PLAN_FORMAT = "myorganizer-plan"
+PLAN_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+
+
+def _identity(file: ScanEntry) -> Tuple[Optional[int], Optional[int]]:
+    """Size and mtime of the entry. Moving files into a directory changes
+    its mtime, so directories are only checked for existence."""
+    if file.stat is None or file.is_dir:
+        return None, None
+    return file.stat.st_size, file.stat.st_mtime_ns
+
+
+def current_entry(path: Path) -> Optional[ScanEntry]:
+    """Returns the entry at path as scan_folder would see it, None when
+    there is none."""
+    try:
+        lstat_result = os.lstat(path)
+    except OSError:
+        return None
+    is_symlink = stat.S_ISLNK(lstat_result.st_mode)
+    stat_result: Optional[os.stat_result] = lstat_result
+    if is_symlink:
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+    if stat_result is None:
+        return ScanEntry(path.parent, path.name, IS_SYMLINK, None)
+    return ScanEntry(path.parent, path.name,
+                     (IS_SYMLINK if is_symlink else 0)
+                     | (IS_DIR if stat.S_ISDIR(stat_result.st_mode) else 0)
+                     | READABLE | WRITABLE, EntryStat(stat_result))
+
+
+def operation_record(operation: Operation) -> Optional[Dict[str, Any]]:
+    """Returns the plan line of an operation, None for ignored entries."""
+    match operation:
+        case Ignore(_):
+            return None
+        case MakeDir(path):
+            return {"op": "mkdir", "path": str(path)}
+        case Move(file, destination, _):
+            size, mtime_ns = _identity(file)
+            return {"op": "move", "source": str(file), "size": size,
+                    "mtime_ns": mtime_ns, "destination": str(destination)}
+        case Delete(file) | Trash(file):
+            size, mtime_ns = _identity(file)
+            return {"op": "delete" if isinstance(operation, Delete)
+                    else "trash", "source": str(file), "size": size,
+                    "mtime_ns": mtime_ns}
+    raise ValueError(f"Unknown operation {operation!r}")
+
+
+class PlanWriter:
+    """Streams planned operations to a JSON lines file. The first line
+    names the format, every other line is one operation."""
+
+    def __init__(self, path: Path | str,
+                 config_path: Optional[Path | str] = None) -> None:
+        self.path = Path(path)
+        self.written: int = 0
+        self.__file: IO[str] = open(self.path, "w", encoding="utf-8")
+        self.__write({"format": PLAN_FORMAT, "version": PLAN_VERSION,
+                      "config": (str(config_path) if config_path is not None
+                                 else None)})
+
+    def __write(self, record: Dict[str, Any]) -> None:
+        self.__file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def record(self, operations: Iterable[Operation]) -> Iterator[Operation]:
+        """Yields the operations and writes each one as it passes."""
+        for operation in operations:
+            record = operation_record(operation)
+            if record is not None:
+                self.__write(record)
+                self.written += 1
+            yield operation
+
+    def close(self) -> None:
+        """Flushes and closes the plan file."""
+        self.__file.close()
+
+
+class PlanApplier:
+    """Replays a plan written by PlanWriter.
+
+    Entries whose size or mtime changed since planning, that vanished or
+    whose destination is taken by now are skipped and reported. With a
+    journal, the line numbers of completed operations are appended to
+    the plan path plus .journal, applying the same plan again resumes
+    after them. The journal is removed once every operation succeeded."""
+
+    def __init__(self, path: Path | str,
+                 update_function: Optional[Callable[[str], None]] = None,
+                 journal: bool = True) -> None:
+        self.path = Path(path)
+        self.update_function = update_function
+        self.journal_path = self.path.with_name(self.path.name
+                                                + JOURNAL_SUFFIX)
+        self.changed: int = 0
+        self.done: Set[int] = set()
+        if self.journal_path.exists():
+            with open(self.journal_path, encoding="utf-8") as journal_file:
+                # The last line may be cut short by the interruption.
+                self.done = {int(line) for line in journal_file
+                             if line.strip().isdigit()}
+        self.resumed: int = len(self.done)
+        self.__numbers: Dict[Operation, int] = {}
+        self.__lock = threading.Lock()
+        self.__journal: Optional[IO[str]] = None
+        self.__destinations = DestinationIndex()
+
+        with open(self.path, encoding="utf-8") as plan_file:
+            header = plan_file.readline()
+        try:
+            values = json.loads(header)
+        except ValueError:
+            values = None
+        if not isinstance(values, dict) or values.get("format") != PLAN_FORMAT:
+            raise ValueError(f"{self.path} is not a MyOrganizer plan")
+        if values.get("version") != PLAN_VERSION:
+            raise ValueError(f"{self.path} has unsupported version "
+                             f"{values.get('version')}")
+        if journal:
+            self.__journal = open(self.journal_path, "a", encoding="utf-8",
+                                  buffering=1)
+
+    def __skip(self, message: str) -> None:
+        self.changed += 1
+        if self.update_function is not None:
+            self.update_function(message)
+
+    def __source(self, record: Dict[str, Any]) -> Optional[ScanEntry]:
+        """Returns the source entry if it is unchanged since planning."""
+        entry = current_entry(Path(record["source"]))
+        if entry is None:
+            self.__skip(f"Skipping {record['source']}, it is gone")
+            return None
+        if _identity(entry) != (record.get("size"), record.get("mtime_ns")):
+            self.__skip(f"Skipping {entry}, it changed since planning")
+            return None
+        return entry
+
+    def __operation(self, record: Dict[str, Any]) -> Optional[Operation]:
+        match record.get("op"):
+            case "mkdir":
+                return MakeDir(Path(record["path"]))
+            case "move":
+                destination = Path(record["destination"])
+                entry = self.__source(record)
+                if entry is None:
+                    return None
+                if os.path.lexists(destination):
+                    self.__skip(f"Skipping {entry}, {destination} exists")
+                    return None
+                return Move(entry, destination,
+                            self.__destinations.same_device(
+                                entry, destination.parent))
+            case "delete":
+                entry = self.__source(record)
+                return Delete(entry) if entry is not None else None
+            case "trash":
+                entry = self.__source(record)
+                return Trash(entry) if entry is not None else None
+        raise ValueError(f"unknown operation {record.get('op')!r}")
+
+    def operations(self) -> Iterator[Operation]:
+        """Yields the operations still to apply, checking every source
+        right before it is handed out. Raises ValueError for invalid
+        lines."""
+        with open(self.path, encoding="utf-8") as plan_file:
+            plan_file.readline()
+            for number, line in enumerate(plan_file, 2):
+                if number in self.done or not line.strip():
+                    continue
+                try:
+                    operation = self.__operation(json.loads(line))
+                except (ValueError, KeyError, TypeError, AttributeError) as exc:
+                    raise ValueError(f"{self.path}, line {number}: "
+                                     f"{exc}") from exc
+                if operation is None:
+                    continue
+                if self.__journal is not None:
+                    with self.__lock:
+                        self.__numbers[operation] = number
+                yield operation
+
+    def completed(self, operation: Operation) -> None:
+        """Journals a completed operation, called by the Executor."""
+        with self.__lock:
+            number = self.__numbers.pop(operation, None)
+            if number is not None and self.__journal is not None:
+                self.__journal.write(f"{number}\n")
+
+    def close(self, succeeded: bool) -> None:
+        """Closes the journal, removing it if the plan was applied in
+        full."""
+        if self.__journal is None:
+            return
+        self.__journal.close()
+        self.__journal = None
+        if succeeded:
+            self.journal_path.unlink(missing_ok=True)
@@ -0,0 +1,210 @@
+"""Compiled organization rules used by MyOrganizer"""
+from pathlib import PurePath
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+import argparse
+import sys
+
+from patterns import PatternMatcher
+from scanner import FolderSnapshot, NameIndex, ScanEntry
+
+ARCHIVE_SUFFIXES: FrozenSet[str] = frozenset({".tar", ".zip", ".7z", ".rar"})
+COMPRESSION_SUFFIXES: FrozenSet[str] = frozenset({".gz", ".bz2", ".xz",
+                                                  ".zst"})
+
+ContentTypeFunction = Callable[[ScanEntry], Tuple[str, ...]]
+
+
+def archive_stem(name: str, suffixes: List[str]) -> str:
+    """Strips archive and compression suffixes from the name."""
+    for suffix in reversed(suffixes):
+        if suffix not in ARCHIVE_SUFFIXES and suffix not in COMPRESSION_SUFFIXES:
+            break
+        name = name[:-len(suffix)]
+    return name
+
+
+def lock_owner_name(name: str) -> str:
+    """Returns the name of the file a lock file belongs to."""
+    for substring in [".lock", "lock", "~", "#"]:
+        name = name.replace(substring, "")
+    return name
+
+
+def top_folder(folder_name: str) -> str:
+    """Returns the folder a destination such as Archives/Compressed is
+    created in."""
+    parts = PurePath(folder_name).parts
+    return parts[0] if parts else folder_name
+
+
+def is_lock_name(name: str, suffixes: List[str]) -> bool:
+    """Whether the name looks like a lock or a temporary copy."""
+    return bool(suffixes) and (
+        suffixes[-1].endswith("#") or
+        suffixes[-1] == ".lock" or
+        name.startswith("~")
+    )
+
+
+class Rules(NamedTuple):
+    """Immutable lookup tables compiled from a Config."""
+    suffix_table: Mapping[str, str]
+    destinations: FrozenSet[str]
+    directories: Optional[str]
+    symlinks: Optional[str]
+    extracted_archives: Optional[str]
+    executable_no_extension: str
+    no_extension: str
+    unknown_extension: str
+    handle_locked_files: bool
+    patterns: Optional[PatternMatcher] = None
+    duplicates: Optional[str] = None
+    sniff_content: bool = False
+
+    @classmethod
+    def compile(cls, file_types: Dict[str, str],
+                special_file_types: Dict[str, str],
+                settings: Dict[str, Any],
+                pattern_rules: Optional[List[Dict[str, Any]]] = None
+                ) -> "Rules":
+        """Compiles the config dictionaries into lookup tables. Raises
+        ValueError for invalid pattern rules."""
+        patterns = (PatternMatcher.compile(pattern_rules)
+                    if pattern_rules else None)
+        unknown_extension = special_file_types.get("unknown-extension",
+                                                   "!ignore")
+        no_extension = special_file_types.get("no-extension",
+                                              unknown_extension)
+        destinations = [*file_types.values(), *special_file_types.values(),
+                        *(patterns.folders if patterns is not None else ())]
+        return cls(
+            suffix_table=MappingProxyType(
+                {f".{suffix}": folder for suffix, folder
+                 in file_types.items()}),
+            destinations=frozenset(
+                top_folder(folder) for folder in destinations
+                if not folder.startswith("!")),
+            directories=special_file_types.get("directories"),
+            symlinks=special_file_types.get("symlinks"),
+            extracted_archives=special_file_types.get("extracted-archives"),
+            executable_no_extension=special_file_types.get(
+                "executable-no-extension", no_extension),
+            no_extension=no_extension,
+            unknown_extension=unknown_extension,
+            handle_locked_files=bool(
+                settings.get("handle-locked-files", False)),
+            patterns=patterns,
+            duplicates=special_file_types.get("duplicates"),
+            sniff_content=bool(settings.get("sniff-content", False)),
+        )
+
+    @property
+    def time_dependent(self) -> bool:
+        """Whether the folder of an unchanged entry can change over time."""
+        return self.patterns is not None and self.patterns.uses_age
+
+    def match_suffixes(self, suffixes: List[str]) -> Optional[str]:
+        """Returns the folder of the last suffix found in file-types."""
+        for suffix in reversed(suffixes):
+            folder_name = self.suffix_table.get(suffix)
+            if folder_name is not None:
+                return folder_name
+        return None
+
+    def folder_name(self, file: ScanEntry, index: NameIndex,
+                    content_type: Optional[ContentTypeFunction] = None
+                    ) -> str:
+        """Gets the folder name of a file, siblings are looked up in the
+        index of its folder. content_type returns the suffixes the
+        content of a file stands for, they are tried before the
+        no-extension and unknown-extension fallbacks."""
+        suffixes: List[str] = file.suffixes
+        folder_name: Optional[str] = None
+
+        if not file.writable or not file.readable:
+            folder_name = "!ignore"
+        elif file.is_dir:
+            if (self.directories is not None
+                    and file.name not in self.destinations):
+                folder_name = self.directories
+            else:
+                folder_name = "!ignore"
+        elif file.is_symlink:
+            if self.symlinks is not None:
+                folder_name = self.symlinks
+            else:
+                folder_name = self.match_suffixes(suffixes)
+        elif is_lock_name(file.name, suffixes):
+            if self.handle_locked_files:
+                position = index.remaining(lock_owner_name(file.name))
+                if position is not None:
+                    index.skip(position)
+                    folder_name = "!ignore"
+            elif suffixes[-1] == ".lock":
+                suffixes.pop()
+        else:
+            if self.handle_locked_files:
+                position = index.remaining_containing(file.name)
+                if position is not None:
+                    index.skip(position)
+                    folder_name = "!ignore"
+
+            pattern_folder: Optional[str] = None
+            if not folder_name and self.patterns is not None:
+                pattern_folder = self.patterns.match(file)
+            if pattern_folder is not None:
+                folder_name = pattern_folder
+            elif (not folder_name and self.extracted_archives is not None
+                    and not ARCHIVE_SUFFIXES.isdisjoint(suffixes)):
+                if (index.has_directory(archive_stem(file.name, suffixes))
+                        or index.has_directory_containing(file.name)):
+                    folder_name = self.extracted_archives
+            if not folder_name:
+                folder_name = self.match_suffixes(suffixes)
+
+        if not folder_name and content_type is not None:
+            for suffix in content_type(file):
+                folder_name = self.suffix_table.get(suffix)
+                if folder_name is not None:
+                    break
+
+        if not folder_name and not suffixes and file.executable:
+            folder_name = self.executable_no_extension
+        elif not folder_name and not suffixes:
+            folder_name = self.no_extension
+        if not folder_name:
+            folder_name = self.unknown_extension
+        return folder_name
+
+    def classify(self, snapshot: FolderSnapshot,
+                 args_: argparse.Namespace,
+                 known: Optional[Callable[[ScanEntry], Optional[str]]] = None,
+                 only: Optional[Set[str]] = None,
+                 content_type: Optional[ContentTypeFunction] = None
+                 ) -> Iterator[Tuple[ScanEntry, str]]:
+        """Yields every entry that is not skipped as a sibling together
+        with its folder name. Entries that known returns a folder name for
+        are not classified again. When only is given, just the entries with
+        those names are classified and every other entry of the folder
+        counts as an unprocessed sibling until it is classified itself.
+        content_type is passed on to folder_name."""
+        index = snapshot.name_index()
+        for position, file in enumerate(snapshot.entries):
+            if index.skipped[position]:
+                continue
+            if only is not None:
+                if file.name not in only:
+                    continue
+            else:
+                index.cursor = position
+            index.current = position
+            folder_name = known(file) if known is not None else None
+            if folder_name is None:
+                folder_name = self.folder_name(file, index, content_type)
+            if args_.debug and not args_.quiet:
+                # Kept off stdout, which may be a JSON Lines stream.
+                print(folder_name, file=sys.stderr)
+            yield file, folder_name
+            if only is not None:
+                index.skip(position)
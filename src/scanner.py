@@ -0,0 +1,342 @@
+"""Folder scanning tools for MyOrganizer"""
+from bisect import bisect_right
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import os
+import stat
+
+# Longest name fragment indexed for substring lookups.
+GRAM_SIZE = 5
+
+# Type and access bits of ScanEntry.flags.
+IS_DIR = 1
+IS_SYMLINK = 2
+READABLE = 4
+WRITABLE = 8
+EXECUTABLE = 16
+
+
+def suffix_start(name: str) -> int:
+    """Returns where the suffixes of the name start as Path.suffixes
+    splits them, the length of the name when it has none."""
+    if name.endswith("."):
+        return len(name)
+    position = name.find(".", len(name) - len(name.lstrip(".")))
+    return len(name) if position < 0 else position
+
+
+def name_suffixes(name: str, start: Optional[int] = None) -> List[str]:
+    """Suffixes of the name, same as Path.suffixes. start is the result
+    of suffix_start if already known."""
+    if start is None:
+        start = suffix_start(name)
+    if start == len(name):
+        return []
+    return ["." + suffix for suffix in name[start + 1:].split(".")]
+
+
+class EntryStat:
+    """The fields of an os.stat_result MyOrganizer uses, in a fraction of
+    its memory."""
+    __slots__ = ("st_mode", "st_size", "st_mtime_ns", "st_dev", "st_ino")
+
+    def __init__(self, stat_result: os.stat_result) -> None:
+        self.st_mode: int = stat_result.st_mode
+        self.st_size: int = stat_result.st_size
+        self.st_mtime_ns: int = stat_result.st_mtime_ns
+        self.st_dev: int = stat_result.st_dev
+        self.st_ino: int = stat_result.st_ino
+
+    @property
+    def st_mtime(self) -> float:
+        """Modification time in seconds."""
+        return self.st_mtime_ns / 1e9
+
+
+class ScanEntry:
+    """Folder entry with its type and access info recorded once.
+
+    Entries of a folder share its Path, an entry keeps its name, the type
+    and access bits, a compact stat and where the suffixes of its name
+    start. Its own Path is only built when an operation needs it."""
+    __slots__ = ("folder", "name", "flags", "stat", "suffix_start")
+
+    def __init__(self, folder: Path, name: str, flags: int,
+                 stat_result: Optional[EntryStat]) -> None:
+        self.folder: Path = folder
+        self.name: str = name
+        self.flags: int = flags
+        self.stat: Optional[EntryStat] = stat_result
+        self.suffix_start: int = suffix_start(name)
+
+    @property
+    def path(self) -> Path:
+        """Path of the entry."""
+        return self.folder.joinpath(self.name)
+
+    @property
+    def is_dir(self) -> bool:
+        """Whether the entry is a directory, following symlinks like
+        Path.is_dir."""
+        return bool(self.flags & IS_DIR)
+
+    @property
+    def is_symlink(self) -> bool:
+        """Whether the entry is a symlink."""
+        return bool(self.flags & IS_SYMLINK)
+
+    @property
+    def readable(self) -> bool:
+        """Whether the entry can be read."""
+        return bool(self.flags & READABLE)
+
+    @property
+    def writable(self) -> bool:
+        """Whether the entry can be written."""
+        return bool(self.flags & WRITABLE)
+
+    @property
+    def executable(self) -> bool:
+        """Whether the entry can be executed."""
+        return bool(self.flags & EXECUTABLE)
+
+    @property
+    def suffixes(self) -> List[str]:
+        """Suffixes of the entry name, same as Path.suffixes."""
+        return name_suffixes(self.name, self.suffix_start)
+
+    @property
+    def is_regular_file(self) -> bool:
+        """Whether the entry is a regular file and not a symlink."""
+        return (not self.flags & IS_SYMLINK and self.stat is not None
+                and stat.S_ISREG(self.stat.st_mode))
+
+    def __str__(self) -> str:
+        return os.path.join(self.folder, self.name)
+
+    def __repr__(self) -> str:
+        return f"ScanEntry({str(self)!r})"
+
+
+class FolderSnapshot:
+    """Entries of a folder scanned in a single pass."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder: Path = folder
+        self.entries: List[ScanEntry] = []
+        self.syscalls: int = 0
+        self.__index: Optional[NameIndex] = None
+
+    def __iter__(self) -> Iterator[ScanEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def count_syscalls(self, amount: int = 1) -> None:
+        """Records syscalls made on behalf of this snapshot."""
+        self.syscalls += amount
+
+    def name_index(self) -> "NameIndex":
+        """Returns the name index of the snapshot, building it once."""
+        if self.__index is None:
+            self.__index = NameIndex(self.entries)
+        return self.__index
+
+
+class NameIndex:
+    """Sibling lookups over the entries of a folder.
+
+    Entries up to cursor count as processed, current is the entry being
+    classified and never matches itself. Matched siblings are marked in
+    skipped instead of being removed from the entry list. lookups counts
+    the sibling lookups made so far."""
+
+    def __init__(self, entries: List[ScanEntry]) -> None:
+        self.entries: List[ScanEntry] = entries
+        self.positions: Dict[str, int] = {
+            entry.name: position for position, entry in enumerate(entries)}
+        self.skipped: bytearray = bytearray(len(entries))
+        self.cursor: int = -1
+        self.current: int = -1
+        self.lookups: int = 0
+        self.__grams: Dict[int, Dict[str, List[int]]] = {}
+        self.__directory_names: Optional[Set[str]] = None
+
+    def __build_grams(self, size: int) -> Dict[str, List[int]]:
+        grams: Dict[str, List[int]] = {}
+        for position, entry in enumerate(self.entries):
+            name = entry.name
+            for gram in {name[i:i + size]
+                         for i in range(len(name) - size + 1)}:
+                postings = grams.get(gram)
+                if postings is None:
+                    grams[gram] = [position]
+                else:
+                    postings.append(position)
+        return grams
+
+    def __candidates(self, name: str, start: int) -> Iterable[int]:
+        size = min(len(name), GRAM_SIZE)
+        grams = self.__grams.get(size)
+        if grams is None:
+            grams = self.__grams[size] = self.__build_grams(size)
+        best: Optional[List[int]] = None
+        for i in range(len(name) - size + 1):
+            postings = grams.get(name[i:i + size])
+            if postings is None:
+                return ()
+            if best is None or len(postings) < len(best):
+                best = postings
+        assert best is not None
+        return (best[i] for i in
+                range(bisect_right(best, start - 1), len(best)))
+
+    def skip(self, position: int) -> None:
+        """Marks the entry so it is not processed."""
+        self.skipped[position] = 1
+
+    def remaining(self, name: str) -> Optional[int]:
+        """Position of the unprocessed entry with exactly this name."""
+        self.lookups += 1
+        position = self.positions.get(name)
+        if (position is not None and position > self.cursor
+                and position != self.current
+                and not self.skipped[position]):
+            return position
+        return None
+
+    def remaining_containing(self, name: str) -> Optional[int]:
+        """Position of the first unprocessed entry whose name contains
+        the given name."""
+        self.lookups += 1
+        for position in self.__candidates(name, self.cursor + 1):
+            if (not self.skipped[position] and position != self.current
+                    and name in self.entries[position].name):
+                return position
+        return None
+
+    def has_directory(self, name: str) -> bool:
+        """Whether a directory with exactly this name exists."""
+        self.lookups += 1
+        if self.__directory_names is None:
+            self.__directory_names = {
+                entry.name for entry in self.entries if entry.is_dir}
+        return name in self.__directory_names
+
+    def has_directory_containing(self, name: str) -> bool:
+        """Whether the name of any directory contains the given name."""
+        self.lookups += 1
+        return any(self.entries[position].is_dir
+                   and name in self.entries[position].name
+                   for position in self.__candidates(name, 0))
+
+
+class _AccessChecker:
+    """Derives os.access results from an already fetched stat result."""
+
+    def __init__(self, folder: Path, snapshot: FolderSnapshot) -> None:
+        self.posix: bool = os.name == "posix"
+        self.read_only_fs: bool = False
+        if self.posix:
+            self.euid: int = os.geteuid()
+            self.groups = set(os.getgroups())
+            self.groups.add(os.getegid())
+            try:
+                self.read_only_fs = bool(
+                    os.statvfs(folder).f_flag & os.ST_RDONLY)
+            except OSError:
+                pass
+            snapshot.count_syscalls()
+
+    def check(self, stat_result: os.stat_result) -> int:
+        """Returns the READABLE, WRITABLE and EXECUTABLE bits."""
+        mode = stat_result.st_mode
+        is_dir = stat.S_ISDIR(mode)
+        if not self.posix:
+            # Windows only honours the read-only attribute for files.
+            attributes = getattr(stat_result, "st_file_attributes", 0)
+            writable = is_dir or not attributes & stat.FILE_ATTRIBUTE_READONLY
+            return READABLE | EXECUTABLE | (WRITABLE if writable else 0)
+        if self.euid == 0:
+            readable = writable = True
+            executable = is_dir or bool(mode & 0o111)
+        else:
+            if stat_result.st_uid == self.euid:
+                shift = 6
+            elif stat_result.st_gid in self.groups:
+                shift = 3
+            else:
+                shift = 0
+            readable = bool(mode & (stat.S_IROTH << shift))
+            writable = bool(mode & (stat.S_IWOTH << shift))
+            executable = bool(mode & (stat.S_IXOTH << shift))
+        return ((READABLE if readable else 0)
+                | (WRITABLE if writable and not self.read_only_fs else 0)
+                | (EXECUTABLE if executable else 0))
+
+
+def scan_folder(folder: Path | str,
+                names: Optional[Set[str]] = None) -> FolderSnapshot:
+    """Scans the folder once using os.scandir and returns a snapshot. When
+    names is given only those entries are stat'ed, the others only carry
+    their name and type for sibling lookups."""
+    if not isinstance(folder, Path):
+        folder = Path(folder)
+
+    snapshot = FolderSnapshot(folder)
+    access = _AccessChecker(folder, snapshot)
+
+    with os.scandir(folder) as iterator:
+        snapshot.count_syscalls()
+        for dir_entry in iterator:
+            symlink_flag = IS_SYMLINK if dir_entry.is_symlink() else 0
+            if names is not None and dir_entry.name not in names:
+                snapshot.entries.append(ScanEntry(
+                    folder, dir_entry.name, symlink_flag
+                    | (IS_DIR if dir_entry.is_dir() else 0), None))
+                continue
+            if access.posix or symlink_flag:
+                snapshot.count_syscalls()
+            try:
+                stat_result = dir_entry.stat()
+            except OSError:
+                # Broken symlinks and vanished entries can't be accessed.
+                snapshot.entries.append(ScanEntry(
+                    folder, dir_entry.name, symlink_flag, None))
+                continue
+            snapshot.entries.append(ScanEntry(
+                folder, dir_entry.name,
+                symlink_flag | access.check(stat_result)
+                | (IS_DIR if stat.S_ISDIR(stat_result.st_mode) else 0),
+                EntryStat(stat_result)))
+
+    return snapshot
+
+
+def walk_folder(folder: Path | str,
+                descend: Callable[[ScanEntry, int], bool]
+                ) -> Iterator[FolderSnapshot]:
+    """Yields a snapshot of the folder and then, depth first, of every
+    subfolder descend accepts. descend gets the entry and its depth, 1 for
+    children of the folder. Subfolders of a snapshot are only looked at
+    once the caller asks for the next one, so folders moved away while
+    handling their parent are not scanned. Only one snapshot and the paths
+    of the folders still to scan are kept in memory. Subfolders that can
+    not be scanned are skipped."""
+    pending: List[Tuple[Path, int]] = [(Path(folder), 0)]
+    while pending:
+        path, depth = pending.pop()
+        try:
+            snapshot = scan_folder(path)
+        except OSError:
+            if depth == 0:
+                raise
+            continue
+        yield snapshot
+        children = [entry.path for entry in snapshot
+                    if entry.is_dir and not entry.is_symlink
+                    and descend(entry, depth + 1)
+                    and os.path.isdir(entry.path)]
+        del snapshot
+        pending.extend((child, depth + 1) for child in reversed(children))
@@ -0,0 +1,185 @@
+"""Content type detection by magic bytes used by MyOrganizer"""
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+
+from filecache import CachedReader, FileCache, cache_path
+from scanner import EntryStat, ScanEntry
+
+CONTENT_TYPES_FILE_NAME = "content-types.sqlite3"
+# Bytes read from the start of a file.
+HEADER_SIZE = 4096
+# Files read on the calling thread below this count, and files read by
+# one pool task.
+POOL_THRESHOLD = 256
+
+# Magic bytes at the start of a file and the file-types suffixes they
+# stand for, most likely first. More specific signatures come first.
+SIGNATURES: List[Tuple[bytes, Tuple[str, ...]]] = [
+    (rb"\x7fELF.{14}\x3e\x00", (".elf", ".x86-64", ".x86_64")),
+    (rb"\x7fELF.{14}\x03\x00", (".elf", ".x86")),
+    (rb"\x7fELF", (".elf",)),
+    (rb"MZ", (".exe",)),
+    (rb"#![^\n]*python", (".py",)),
+    (rb"#![^\n]*\b(?:ba|da|z|k)?sh\b", (".sh",)),
+    (rb"%PDF-", (".pdf",)),
+    (rb"\x89PNG\r\n\x1a\n", (".png",)),
+    (rb"\xff\xd8\xff", (".jpg", ".jpeg")),
+    (rb"GIF8[79]a", (".gif",)),
+    (rb"RIFF.{4}WEBP", (".webp",)),
+    (rb"RIFF.{4}WAVE", (".wav",)),
+    (rb"RIFF.{4}AVI ", (".avi",)),
+    (rb".{4}ftypM4A", (".m4a",)),
+    (rb".{4}ftyp", (".mp4",)),
+    (rb"\x1a\x45\xdf\xa3", (".webm", ".mkv")),
+    (rb"ID3|\xff[\xfb\xf3\xf2]", (".mp3",)),
+    (rb"OggS", (".ogg",)),
+    (rb"fLaC", (".flac",)),
+    (rb"PK(?:\x03\x04|\x05\x06)", (".zip",)),
+    (rb"\x1f\x8b", (".gz",)),
+    (rb"BZh[1-9]", (".bz2",)),
+    (rb"\xfd7zXZ\x00", (".xz",)),
+    (rb"\x28\xb5\x2f\xfd", (".zst",)),
+    (rb"7z\xbc\xaf\x27\x1c", (".7z",)),
+    (rb"Rar!\x1a\x07", (".rar",)),
+    (rb".{257}ustar", (".tar",)),
+    (rb"\xed\xab\xee\xdb", (".rpm",)),
+    (rb"!<arch>\ndebian", (".deb",)),
+    (rb"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", (".doc", ".xls", ".ppt", ".msi")),
+    (rb"SQLite format 3\x00", (".sqlite", ".db")),
+    (rb"\xca\xfe\xba\xbe", (".class",)),
+    (rb"\x00asm", (".wasm",)),
+    (rb"\x00\x00\x01\x00", (".ico",)),
+    (rb"(?:<\?xml[^>]*>\s*)?<svg", (".svg",)),
+]
+
+# Every signature is a named group of one alternation, so a single match
+# finds the first signature of the table a header starts with.
+_SIGNATURES = re.compile(b"|".join(
+    b"(?P<s%d>%s)" % (number, signature)
+    for number, (signature, _) in enumerate(SIGNATURES)), re.DOTALL)
+
+ContentType = Tuple[str, ...]
+
+
+def content_types_path(config_file: Path | str) -> Path:
+    """Returns the path of the content type cache next to the config
+    file."""
+    return cache_path(config_file, CONTENT_TYPES_FILE_NAME)
+
+
+def match_header(header: bytes) -> ContentType:
+    """Returns the suffixes the header stands for, empty if unknown."""
+    match = _SIGNATURES.match(header)
+    if match is None or match.lastgroup is None:
+        return ()
+    return SIGNATURES[int(match.lastgroup[1:])][1]
+
+
+def read_header(path: Path | str) -> Optional[bytes]:
+    """Reads the start of a file, None if it can not be read."""
+    try:
+        with open(path, "rb", buffering=0) as file:
+            return file.read(HEADER_SIZE)
+    except OSError:
+        return None
+
+
+def read_headers(paths: List[str]) -> List[Optional[bytes]]:
+    """Reads the start of every file."""
+    return [read_header(path) for path in paths]
+
+
+def sniffable(file: ScanEntry) -> bool:
+    """Whether the content of the entry can be looked at."""
+    return (file.is_regular_file and file.readable
+            and file.stat is not None and file.stat.st_size > 0)
+
+
+class ContentTypeCache(FileCache):
+    """Content types of earlier runs, stored as their suffixes."""
+    table = "content_types"
+    columns = ("suffixes TEXT",)
+
+    def get_many(self, stat_results: List[EntryStat]
+                 ) -> Dict[Tuple[int, int], ContentType]:
+        """Returns the cached content types of the files that are
+        unchanged, keyed by device and inode."""
+        return {key: tuple(suffixes.split()) for key, (suffixes,)
+                in self.lookup(stat_results).items()}
+
+    def put_many(self, files: List[Tuple[EntryStat, ContentType]]
+                 ) -> None:
+        """Records the content types of files."""
+        with self.connection:
+            self.record([(stat_result, (" ".join(content_type),))
+                         for stat_result, content_type in files])
+
+
+class ContentSniffer(CachedReader):
+    """Detects the content type of files from their first bytes.
+
+    prefetch reads the headers of the files of a folder up front, on a
+    thread pool with jobs above 1, so classification only looks them up.
+    Files that were not prefetched are read when asked for."""
+
+    cache: Optional[ContentTypeCache]
+
+    def __init__(self, cache: Optional[ContentTypeCache] = None,
+                 jobs: int = 1) -> None:
+        super().__init__(cache, jobs)
+        self.read: int = 0
+        self.__types: Dict[ScanEntry, ContentType] = {}
+
+    def __store(self, files: List[ScanEntry],
+                headers: Iterable[Optional[bytes]]) -> None:
+        read: List[Tuple[EntryStat, ContentType]] = []
+        for file, header in zip(files, headers):
+            content_type = match_header(header) if header is not None else ()
+            self.__types[file] = content_type
+            if header is not None and file.stat is not None:
+                read.append((file.stat, content_type))
+        if self.cache is not None and read:
+            self.cache.put_many(read)
+
+    def prefetch(self, files: Iterable[ScanEntry]) -> None:
+        """Detects the content types of the files, replacing those of the
+        previous folder."""
+        self.__types.clear()
+        candidates = [file for file in files if sniffable(file)]
+        missing = candidates
+        if self.cache is not None and candidates:
+            cached = self.cache.get_many([file.stat for file in candidates
+                                          if file.stat is not None])
+            missing = []
+            for file in candidates:
+                assert file.stat is not None
+                content_type = cached.get((file.stat.st_dev,
+                                           file.stat.st_ino))
+                if content_type is not None:
+                    self.__types[file] = content_type
+                else:
+                    missing.append(file)
+        self.read += len(missing)
+
+        paths = [str(file) for file in missing]
+        if self.jobs > 1 and len(paths) >= 2 * POOL_THRESHOLD:
+            # Chunks keep the cost of a task small next to its reads.
+            chunks = self.pool.map(read_headers, [
+                paths[start:start + POOL_THRESHOLD]
+                for start in range(0, len(paths), POOL_THRESHOLD)])
+            self.__store(missing, (header for chunk in chunks
+                                   for header in chunk))
+        else:
+            self.__store(missing, map(read_header, paths))
+
+    def content_type(self, file: ScanEntry) -> ContentType:
+        """Returns the suffixes the content of the file stands for."""
+        content_type = self.__types.get(file)
+        if content_type is None:
+            if not sniffable(file):
+                return ()
+            self.read += 1
+            self.__store([file], [read_header(str(file))])
+            content_type = self.__types[file]
+        return content_type
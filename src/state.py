@@ -0,0 +1,163 @@
+"""Persistent scan state used by incremental runs of MyOrganizer"""
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+import os
+import sqlite3
+
+from scanner import FolderSnapshot, ScanEntry
+
+STATE_FILE_NAME = "state.sqlite3"
+# Databases written with another layout of the tables are started over.
+SCHEMA_VERSION = "2"
+
+
+def _identity(file: ScanEntry) -> Tuple[int, int, int]:
+    """Size, mtime and mode of the entry. The mode catches permission
+    changes, which leave the mtime alone. Directories are classified by
+    name only and their mtime changes when files are moved into them, so
+    size and mtime are left out for them."""
+    assert file.stat is not None
+    if file.is_dir:
+        return -1, -1, file.stat.st_mode
+    return file.stat.st_size, file.stat.st_mtime_ns, file.stat.st_mode
+
+
+class StateStore:
+    """Entries ignored by earlier runs, keyed by path, size, mtime and
+    mode.
+
+    An ignored entry is skipped while its size, mtime and mode are
+    unchanged
+    and either its classification did not depend on its siblings or its
+    folder has not changed since the end of the previous run. Siblings
+    that the locked file heuristics skipped are kept as well, so an
+    unchanged folder is not classified again at all. Everything is
+    dropped when the hash of the config changes."""
+
+    def __init__(self, database: Path | str, config_digest: str) -> None:
+        self.database = Path(database)
+        self.connection = sqlite3.connect(self.database)
+        self.skipped: int = 0
+        self.recorded: int = 0
+        self.__folder: Optional[str] = None
+        self.__folder_unchanged: bool = False
+        self.__rows: Dict[str, Tuple[int, int, int, int]] = {}
+        self.__seen: Set[str] = set()
+        self.__skipped_names: Set[str] = set()
+
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY, value TEXT)""")
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is None or row[0] != SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS folders")
+                self.connection.execute("DROP TABLE IF EXISTS ignored")
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('schema', ?)",
+                    (SCHEMA_VERSION,))
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder TEXT PRIMARY KEY, mtime_ns INTEGER);
+                CREATE TABLE IF NOT EXISTS ignored (
+                    folder TEXT, name TEXT, size INTEGER, mtime_ns INTEGER,
+                    mode INTEGER, independent INTEGER,
+                    PRIMARY KEY (folder, name));
+            """)
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'config'").fetchone()
+            if row is None or row[0] != config_digest:
+                self.invalidate()
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('config', ?)",
+                    (config_digest,))
+
+    def invalidate(self) -> None:
+        """Forgets everything recorded by earlier runs."""
+        with self.connection:
+            self.connection.execute("DELETE FROM folders")
+            self.connection.execute("DELETE FROM ignored")
+
+    def begin_folder(self, folder: Path) -> None:
+        """Loads the entries recorded for the folder."""
+        self.__folder = str(folder)
+        self.__seen = set()
+        self.__skipped_names = set()
+        row = self.connection.execute(
+            "SELECT mtime_ns FROM folders WHERE folder = ?",
+            (self.__folder,)).fetchone()
+        try:
+            mtime_ns: Optional[int] = os.stat(folder).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        self.__folder_unchanged = row is not None and row[0] == mtime_ns
+        self.__rows = {
+            name: (size, mtime_ns_, mode, independent)
+            for name, size, mtime_ns_, mode, independent
+            in self.connection.execute(
+                "SELECT name, size, mtime_ns, mode, independent FROM "
+                "ignored WHERE folder = ?", (self.__folder,))}
+
+    def known(self, file: ScanEntry) -> Optional[str]:
+        """Returns !ignore if the entry can be skipped, None otherwise."""
+        self.__seen.add(file.name)
+        row = self.__rows.get(file.name)
+        if row is None or file.stat is None:
+            return None
+        size, mtime_ns, mode, independent = row
+        if ((size, mtime_ns, mode) == _identity(file)
+                and (independent or self.__folder_unchanged)):
+            self.skipped += 1
+            self.__skipped_names.add(file.name)
+            return "!ignore"
+        return None
+
+    def record(self, file: ScanEntry, folder_name: str,
+               independent: bool) -> None:
+        """Records the result of classifying the entry."""
+        if file.name in self.__skipped_names:
+            return
+        if folder_name != "!ignore" or file.stat is None:
+            self.__rows.pop(file.name, None)
+            return
+        self.__rows[file.name] = (*_identity(file), int(independent))
+        self.recorded += 1
+
+    def finish_folder(self, snapshot: FolderSnapshot) -> None:
+        """Stores the entries of the folder after the run touched it."""
+        folder = snapshot.folder
+        assert self.__folder == str(folder)
+        index = snapshot.name_index()
+        for position, entry in enumerate(snapshot.entries):
+            if index.skipped[position] and entry.stat is not None:
+                self.__seen.add(entry.name)
+                self.__rows[entry.name] = (*_identity(entry), 0)
+        try:
+            mtime_ns: Optional[int] = os.stat(folder).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self.connection:
+            self.connection.execute("DELETE FROM ignored WHERE folder = ?",
+                                    (self.__folder,))
+            self.connection.executemany(
+                "INSERT INTO ignored VALUES (?, ?, ?, ?, ?, ?)",
+                ((self.__folder, name, *row)
+                 for name, row in self.__rows.items()
+                 if name in self.__seen))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO folders VALUES (?, ?)",
+                (self.__folder, mtime_ns))
+        self.__folder = None
+        self.__rows = {}
+        self.__seen = set()
+        self.__skipped_names = set()
+
+    def close(self) -> None:
+        """Closes the database."""
+        self.connection.close()
+
+
+def state_path(config_file: Path | str) -> Path:
+    """Returns the path of the state database next to the config file."""
+    return Path(config_file).resolve().parent.joinpath(STATE_FILE_NAME)
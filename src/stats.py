@@ -0,0 +1,185 @@
+"""Run statistics collected by MyOrganizer"""
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, TypeVar
+import heapq
+import json
+import threading
+import time
+
+PHASES = ("scan", "classify", "sniff", "hash", "mkdir", "move",
+          "trash", "delete")
+# Number of slowest operations kept.
+SLOWEST = 10
+
+T = TypeVar("T")
+
+
+def format_bytes(size: float) -> str:
+    """Returns size in a human readable unit."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+
+
+class RunStats:
+    """Time spent per phase and counters of a run.
+
+    Operations performed on the executor's threads add up, so the phase
+    times of a parallel run can exceed its wall time."""
+
+    def __init__(self, slowest: int = SLOWEST) -> None:
+        self.phases: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.operations: Counter = Counter()
+        self.destinations: Counter = Counter()
+        self.commands: Counter = Counter()
+        self.syscalls: Counter = Counter()
+        self.folders: int = 0
+        self.bytes_moved: int = 0
+        self.bytes_copied: int = 0
+        self.wall: float = 0.0
+        self.slowest_count = slowest
+        self.__slowest: List[Tuple[float, str]] = []
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+
+    @property
+    def files(self) -> int:
+        """Number of entries classified."""
+        return sum(self.destinations.values()) + sum(self.commands.values())
+
+    def add(self, phase: str, seconds: float, description: str = "",
+            count: int = 1) -> None:
+        """Adds the duration of count operations to the phase. Operations
+        with a description are candidates for the slowest list."""
+        with self.__lock:
+            self.phases[phase] += seconds
+            self.operations[phase] += count
+            if description:
+                item = (seconds, description)
+                if len(self.__slowest) < self.slowest_count:
+                    heapq.heappush(self.__slowest, item)
+                else:
+                    heapq.heappushpop(self.__slowest, item)
+
+    def timed(self, phase: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yields from iterable and adds the time spent producing every
+        item to the phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, time.perf_counter() - start, count=0)
+                return
+            self.add(phase, time.perf_counter() - start)
+            yield item
+
+    def count(self, folder_name: str) -> None:
+        """Counts an entry classified into folder_name."""
+        if folder_name.startswith("!"):
+            self.commands[folder_name] += 1
+        else:
+            self.destinations[folder_name] += 1
+
+    def moved(self, size: int, copied: int) -> None:
+        """Counts the bytes of a moved file, copied is the part of them
+        copied to another filesystem."""
+        with self.__lock:
+            self.bytes_moved += size
+            self.bytes_copied += copied
+
+    def merge(self, other: "RunStats") -> None:
+        """Adds the statistics of another run, such as one of a worker
+        process, to these."""
+        with self.__lock:
+            for phase, seconds in other.phases.items():
+                self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            self.operations.update(other.operations)
+            self.destinations.update(other.destinations)
+            self.commands.update(other.commands)
+            self.syscalls.update(other.syscalls)
+            self.folders += other.folders
+            self.bytes_moved += other.bytes_moved
+            self.bytes_copied += other.bytes_copied
+            for item in other.slowest():
+                if len(self.__slowest) < self.slowest_count:
+                    heapq.heappush(self.__slowest, item)
+                else:
+                    heapq.heappushpop(self.__slowest, item)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        values = self.__dict__.copy()
+        # Locks can not be pickled, worker processes send their stats.
+        del values["_RunStats__lock"]
+        return values
+
+    def __setstate__(self, values: Dict[str, Any]) -> None:
+        self.__dict__.update(values)
+        self.__lock = threading.Lock()
+
+    def finish(self) -> None:
+        """Records the wall time of the run."""
+        self.wall = time.perf_counter() - self.__start
+
+    def slowest(self) -> List[Tuple[float, str]]:
+        """Returns the slowest operations, slowest first."""
+        with self.__lock:
+            return sorted(self.__slowest, reverse=True)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Returns the statistics as JSON serializable values."""
+        wall = self.wall or time.perf_counter() - self.__start
+        return {
+            "wall_s": round(wall, 4),
+            "folders": self.folders,
+            "files": self.files,
+            "files_per_s": round(self.files / wall, 1) if wall else None,
+            "bytes_moved": self.bytes_moved,
+            "bytes_copied": self.bytes_copied,
+            "phases_s": {phase: round(seconds, 4)
+                         for phase, seconds in self.phases.items()},
+            "operations": dict(self.operations),
+            "destinations": dict(self.destinations.most_common()),
+            "commands": dict(self.commands.most_common()),
+            "syscalls": dict(self.syscalls),
+            "slowest": [{"seconds": round(seconds, 4),
+                         "operation": description}
+                        for seconds, description in self.slowest()],
+        }
+
+    def format(self, as_json: bool = False) -> str:
+        """Returns the statistics as text or as JSON."""
+        values = self.as_dict()
+        if as_json:
+            return json.dumps(values, indent=2)
+
+        lines = [
+            f"Wall time: {values['wall_s']:.3f} s, {values['files']} files "
+            f"in {values['folders']} folders "
+            f"({values['files_per_s']} files/s)",
+            f"Moved {format_bytes(self.bytes_moved)}, "
+            f"{format_bytes(self.bytes_copied)} of it copied across "
+            "filesystems",
+            "Phases:",
+        ]
+        lines.extend(f"  {phase:10} {seconds * 1000:10.1f} ms "
+                     f"{self.operations[phase]:8} operations"
+                     for phase, seconds in self.phases.items())
+        for title, counter in (("Destinations:", self.destinations),
+                               ("Special commands:", self.commands)):
+            if counter:
+                lines.append(title)
+                lines.extend(f"  {count:8}  {name}"
+                             for name, count in counter.most_common())
+        if self.syscalls:
+            lines.append("Syscalls: " + ", ".join(
+                f"{count} {name}" for name, count in self.syscalls.items()))
+        slowest = self.slowest()
+        if slowest:
+            lines.append("Slowest operations:")
+            lines.extend(f"  {seconds * 1000:10.1f} ms  {description}"
+                         for seconds, description in slowest)
+        return "\n".join(lines)
@@ -0,0 +1,268 @@
+"""Throttling of the I/O of MyOrganizer runs"""
+from typing import Any, Dict, NamedTuple, Optional
+import os
+import sys
+import threading
+import time
+
+from transfer import CHUNK_SIZE, ProgressFunction
+
+THROTTLE_KEYS = ("max-operations-per-second", "max-bytes-per-second",
+                 "io-priority", "max-load")
+IO_PRIORITIES = ("low", "idle")
+# Seconds' worth of tokens a bucket holds, the longest burst allowed.
+BURST = 0.1
+# Seconds between two looks at the load average.
+LOAD_CHECK_INTERVAL = 1.0
+# Seconds slept before looking at a load that was too high again.
+LOAD_PAUSE = 5.0
+# Smallest chunk a throttled copy is split into.
+MIN_CHUNK_SIZE = 64 * 1024
+
+# glibc has no wrapper for ioprio_set, it is called by its syscall number.
+IOPRIO_SET = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289,
+              "aarch64": 30, "arm64": 30, "riscv64": 30, "armv7l": 314,
+              "ppc64": 273, "ppc64le": 273, "s390x": 282}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+
+
+def _positive(settings: Dict[str, Any], key: str) -> Optional[float]:
+    value = settings.get(key)
+    if value is None:
+        return None
+    if (isinstance(value, bool) or not isinstance(value, (int, float))
+            or value <= 0):
+        raise ValueError(f"{key} has to be a number above 0, not {value!r}")
+    return float(value)
+
+
+class ThrottleSettings(NamedTuple):
+    """Limits of a run, set in the settings of the config."""
+    operations_per_second: Optional[float] = None
+    bytes_per_second: Optional[float] = None
+    io_priority: Optional[str] = None
+    max_load: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]
+                      ) -> Optional["ThrottleSettings"]:
+        """Reads the throttle keys of settings, None when none of them is
+        set. Raises ValueError for an invalid value."""
+        io_priority = settings.get("io-priority")
+        if io_priority is not None and io_priority not in IO_PRIORITIES:
+            raise ValueError("io-priority has to be one of "
+                             f"{', '.join(IO_PRIORITIES)}, not "
+                             f"{io_priority!r}")
+        throttle = cls(_positive(settings, "max-operations-per-second"),
+                       _positive(settings, "max-bytes-per-second"),
+                       io_priority, _positive(settings, "max-load"))
+        if throttle == cls():
+            return None
+        return throttle
+
+    def share(self, parts: int) -> "ThrottleSettings":
+        """Returns the limits of one of parts runs at the same time, which
+        together stay within these."""
+        parts = max(1, parts)
+        return self._replace(
+            operations_per_second=None
+            if self.operations_per_second is None
+            else self.operations_per_second / parts,
+            bytes_per_second=None if self.bytes_per_second is None
+            else self.bytes_per_second / parts)
+
+
+def set_io_priority(io_priority: str) -> bool:
+    """Moves the calling thread, and the threads and processes it starts
+    later, to the lowest best-effort I/O priority or to the idle I/O
+    class. Returns False where Linux I/O priorities are not available."""
+    if not sys.platform.startswith("linux"):
+        return False
+    number = IOPRIO_SET.get(os.uname().machine.lower())
+    if number is None:
+        return False
+    import ctypes
+    import ctypes.util
+
+    if io_priority == "idle":
+        value = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    else:
+        value = IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT | 7
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.syscall(number, IOPRIO_WHO_PROCESS, 0, value) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+class TokenBucket:
+    """Hands out rate tokens a second, at most BURST seconds' worth at
+    once.
+
+    Taking more tokens than are left puts the bucket in debt, the caller
+    sleeps until it is paid back. Callers on other threads queue up
+    behind the debt without holding the lock while they sleep."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.capacity = max(rate * BURST, 1.0)
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def take(self, amount: float = 1.0) -> float:
+        """Takes amount tokens, waiting until they are available. Returns
+        the seconds waited."""
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens
+                                + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens -= amount
+            delay = max(0.0, -self.__tokens / self.rate)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class Throttle:
+    """Holds a run to the limits of its settings.
+
+    operation is called before every operation that touches the disk,
+    copy_progress wraps the progress of copies across filesystems. What
+    went through is counted to report the rates achieved."""
+
+    def __init__(self, settings: ThrottleSettings) -> None:
+        self.settings = settings
+        self.operations: int = 0
+        self.bytes_copied: int = 0
+        self.waited: float = 0.0
+        self.paused: float = 0.0
+        self.__start = time.monotonic()
+        self.__lock = threading.Lock()
+        self.__next_load_check: float = 0.0
+        self.__operations = (
+            None if settings.operations_per_second is None
+            else TokenBucket(settings.operations_per_second))
+        self.__bytes = (None if settings.bytes_per_second is None
+                        else TokenBucket(settings.bytes_per_second))
+
+    @property
+    def chunk_size(self) -> int:
+        """Bytes copied at once, about a quarter of a second's worth when
+        bytes are limited."""
+        if self.settings.bytes_per_second is None:
+            return CHUNK_SIZE
+        return max(MIN_CHUNK_SIZE, min(
+            CHUNK_SIZE, int(self.settings.bytes_per_second / 4)))
+
+    def operation(self) -> None:
+        """Waits until the next operation may run."""
+        paused = self.__wait_for_load()
+        waited = (self.__operations.take()
+                  if self.__operations is not None else 0.0)
+        with self.__lock:
+            self.operations += 1
+            self.waited += waited
+            self.paused += paused
+
+    def copied(self, size: int) -> None:
+        """Waits until size more bytes may be copied."""
+        paused = self.__wait_for_load()
+        waited = (self.__bytes.take(size)
+                  if self.__bytes is not None else 0.0)
+        with self.__lock:
+            self.bytes_copied += size
+            self.waited += waited
+            self.paused += paused
+
+    def copy_progress(self, progress_function: Optional[ProgressFunction]
+                      ) -> ProgressFunction:
+        """Returns the progress function of a single copy, which holds it
+        to the limits and passes the progress on to progress_function."""
+        last = 0
+
+        def progress(source: Any, copied: int, size: int) -> None:
+            nonlocal last
+            self.copied(copied - last)
+            last = copied
+            if progress_function is not None:
+                progress_function(source, copied, size)
+        return progress
+
+    def __wait_for_load(self) -> float:
+        max_load = self.settings.max_load
+        if max_load is None:
+            return 0.0
+        with self.__lock:
+            now = time.monotonic()
+            if now < self.__next_load_check:
+                return 0.0
+            self.__next_load_check = now + LOAD_CHECK_INTERVAL
+        paused = 0.0
+        while True:
+            try:
+                load = os.getloadavg()[0]
+            except (AttributeError, OSError):
+                # No load average on this system, nothing to wait for.
+                self.settings = self.settings._replace(max_load=None)
+                return paused
+            if load <= max_load:
+                return paused
+            time.sleep(LOAD_PAUSE)
+            paused += LOAD_PAUSE
+
+    def merge(self, other: "Throttle") -> None:
+        """Adds the counters of another run, such as one of a worker
+        process, to these."""
+        with self.__lock:
+            self.operations += other.operations
+            self.bytes_copied += other.bytes_copied
+            self.waited += other.waited
+            self.paused += other.paused
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker processes only send their counters back.
+        return {"settings": self.settings, "operations": self.operations,
+                "bytes_copied": self.bytes_copied, "waited": self.waited,
+                "paused": self.paused}
+
+    def __setstate__(self, values: Dict[str, Any]) -> None:
+        self.__init__(values["settings"])
+        self.operations = values["operations"]
+        self.bytes_copied = values["bytes_copied"]
+        self.waited = values["waited"]
+        self.paused = values["paused"]
+
+    def report(self) -> str:
+        """Returns the rates achieved since the throttle was created."""
+        from stats import format_bytes
+
+        settings = self.settings
+        elapsed = max(time.monotonic() - self.__start, 1e-9)
+        text = (f"Throttled: {self.operations} operations at "
+                f"{self.operations / elapsed:.1f}/s")
+        if settings.operations_per_second is not None:
+            text += f" (limit {settings.operations_per_second:g}/s)"
+        if self.bytes_copied or settings.bytes_per_second is not None:
+            text += (f", {format_bytes(self.bytes_copied)} copied at "
+                     f"{format_bytes(self.bytes_copied / elapsed)}/s")
+        if settings.bytes_per_second is not None:
+            text += f" (limit {format_bytes(settings.bytes_per_second)}/s)"
+        text += f", waited {self.waited:.1f} s for the limits"
+        if settings.max_load is not None:
+            text += (f", paused {self.paused:.1f} s while the load was "
+                     f"above {settings.max_load:g}")
+        return text + "."
+
+
+def open_throttle(settings: Optional[ThrottleSettings], parts: int = 1
+                  ) -> Optional[Throttle]:
+    """Returns the throttle of one of parts runs sharing the limits of
+    settings, None without settings."""
+    if settings is None:
+        return None
+    return Throttle(settings.share(parts))
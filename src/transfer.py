@@ -0,0 +1,105 @@
+"""File transfer tools for MyOrganizer"""
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+import errno
+import os
+import shutil
+import sys
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+ProgressFunction = Callable[[Path, int, int], None]
+
+
+def _copy_range(source_file: BinaryIO, destination_file: BinaryIO,
+                size: int, progress: Callable[[int], None],
+                chunk_size: int = CHUNK_SIZE) -> int:
+    """Copies using the kernel where possible, chunk_size bytes at a
+    time. Returns bytes copied."""
+    source_fd = source_file.fileno()
+    destination_fd = destination_file.fileno()
+    copied = 0
+    kernel_copy = getattr(os, "copy_file_range", None)
+    if kernel_copy is None and sys.platform.startswith("linux"):
+        kernel_copy = os.sendfile
+
+    while kernel_copy is not None and copied < size:
+        try:
+            if kernel_copy is os.sendfile:
+                count = os.sendfile(destination_fd, source_fd, copied,
+                                    min(chunk_size, size - copied))
+            else:
+                count = kernel_copy(source_fd, destination_fd,
+                                    min(chunk_size, size - copied),
+                                    copied, copied)
+        except OSError:
+            if copied:
+                raise
+            # Not supported between these filesystems, copy in userspace.
+            kernel_copy = None
+            break
+        if count == 0:
+            break
+        copied += count
+        progress(copied)
+
+    if kernel_copy is None:
+        view = memoryview(bytearray(min(chunk_size, max(size, 1))))
+        while count := source_file.readinto(view):
+            destination_file.write(view[:count])
+            copied += count
+            progress(copied)
+    return copied
+
+
+def copy_file(source: Path, destination: Path,
+              progress_function: Optional[ProgressFunction] = None,
+              chunk_size: int = CHUNK_SIZE) -> int:
+    """Streams source to destination and checks the size of the copy.
+    Returns the number of bytes copied."""
+    size = os.stat(source).st_size
+
+    def progress(copied: int) -> None:
+        if progress_function is not None:
+            progress_function(source, copied, size)
+
+    with open(source, "rb") as source_file, \
+            open(destination, "xb") as destination_file:
+        try:
+            copied = _copy_range(source_file, destination_file, size,
+                                 progress, chunk_size)
+            destination_file.flush()
+            copied_size = os.fstat(destination_file.fileno()).st_size
+            if copied_size != size:
+                raise OSError(f"Copied {copied_size} of {size} bytes to "
+                              f"{destination}")
+        except BaseException:
+            destination_file.close()
+            os.remove(destination)
+            raise
+    shutil.copystat(source, destination)
+    return copied
+
+
+def move_file(source: Path, destination: Path,
+              same_device: Optional[bool], regular_file: bool,
+              progress_function: Optional[ProgressFunction] = None,
+              chunk_size: int = CHUNK_SIZE) -> int:
+    """Moves a file. Same-device moves are a single rename, regular files
+    on another device are copied, verified and only then unlinked. Other
+    moves are left to shutil.move. Returns the number of bytes copied.
+    Raises FileExistsError instead of replacing an existing destination,
+    which the cached destination listing can miss."""
+    if os.path.lexists(destination):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST),
+                              str(destination))
+    if same_device:
+        os.rename(source, destination)
+        return 0
+    if same_device is False and regular_file:
+        copied = copy_file(source, destination, progress_function,
+                           chunk_size)
+        os.unlink(source)
+        return copied
+    shutil.move(source, destination)
+    return 0
@@ -0,0 +1,264 @@
+"""Watch mode for MyOrganizer"""
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Union
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from config import Config
+from pipeline import Executor, RunContext, describe_failure, existing_folders, plan_folder
+from rules import is_lock_name, lock_owner_name
+from scanner import name_suffixes, scan_folder
+
+# Changed names kept per folder before falling back to a full pass.
+MAX_PENDING = 10000
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+# Changed names per folder, None when the whole folder has to be checked.
+Changes = Dict[Path, Optional[Set[str]]]
+
+
+class PollingWatcher:
+    """Finds changed entries by comparing folder listings."""
+
+    def __init__(self, folders: List[Path], interval: float) -> None:
+        self.interval = interval
+        self.__listings = {folder: self.__list(folder) for folder in folders}
+        self.__next_poll = time.monotonic() + interval
+
+    @staticmethod
+    def __list(folder: Path) -> Dict[str, tuple]:
+        listing: Dict[str, tuple] = {}
+        try:
+            with os.scandir(folder) as iterator:
+                for dir_entry in iterator:
+                    try:
+                        stat_result = dir_entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    listing[dir_entry.name] = (stat_result.st_size,
+                                               stat_result.st_mtime_ns)
+        except OSError:
+            pass
+        return listing
+
+    def wait(self, timeout: float) -> Changes:
+        """Waits up to timeout seconds and returns the changes."""
+        delay = self.__next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return {}
+        time.sleep(max(0.0, delay))
+        self.__next_poll = time.monotonic() + self.interval
+
+        changes: Changes = {}
+        for folder, old in self.__listings.items():
+            new = self.__list(folder)
+            changed = {name for name, identity in new.items()
+                       if old.get(name) != identity}
+            changed.update(name for name in old if name not in new)
+            self.__listings[folder] = new
+            if changed:
+                changes[folder] = changed
+        return changes
+
+    def close(self) -> None:
+        """Releases the watcher."""
+        self.__listings.clear()
+
+
+class InotifyWatcher:
+    """Receives changed entries from inotify on Linux."""
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+            | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+    def __init__(self, folders: List[Path]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd: int = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__folders: Dict[int, Path] = {}
+        for folder in folders:
+            descriptor = libc.inotify_add_watch(
+                self.fd, os.fsencode(folder), self.MASK)
+            if descriptor < 0:
+                errno = ctypes.get_errno()
+                self.close()
+                raise OSError(errno, f"Can not watch {folder}")
+            self.__folders[descriptor] = folder
+
+    def wait(self, timeout: float) -> Changes:
+        """Waits up to timeout seconds and returns the changes."""
+        changes: Changes = {}
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changes
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = struct.unpack_from(
+                    "iIII", data, offset)
+                offset += 16
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    for folder in self.__folders.values():
+                        changes[folder] = None
+                    continue
+                folder = self.__folders.get(descriptor)
+                if folder is None or not name:
+                    continue
+                names = changes.setdefault(folder, set())
+                if names is not None:
+                    names.add(name)
+        return changes
+
+    def close(self) -> None:
+        """Releases the watcher."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+Watcher = Union[InotifyWatcher, PollingWatcher]
+
+
+def create_watcher(folders: List[Path], poll_interval: float,
+                   polling: bool = False) -> Watcher:
+    """Returns an inotify watcher where possible, a polling one otherwise."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(folders, poll_interval)
+
+
+class FolderWatch:
+    """Organizes changed entries of the configured folders as they settle.
+
+    Names are debounced: an entry is handled once no event arrived for it
+    and its mtime is older than debounce seconds. Lock files reuse the
+    locked file heuristics, a lock that goes away puts the file it
+    belongs to back into the queue. The duplicate finder and the content
+    sniffer of the config are opened once for the whole watch."""
+
+    def __init__(self, config: Config, args_: argparse.Namespace,
+                 executor: Executor, update_function: Callable[[str], None],
+                 debounce: float = 2.0, poll_interval: float = 5.0,
+                 polling: bool = False) -> None:
+        # The state only describes whole passes over a folder.
+        self.context = RunContext(config, args_, plan_out=False,
+                                  incremental=False)
+        self.rules = self.context.rules
+        self.args_ = args_
+        self.executor = executor
+        self.update_function = update_function
+        self.debounce = debounce
+        self.folders: List[Path] = [folder_path for _, folder_path
+                                    in existing_folders(config)]
+        self.watcher: Watcher = create_watcher(self.folders, poll_interval,
+                                               polling)
+        self.handled: int = 0
+        self.failed: int = 0
+        self.__pending: Dict[Path, Dict[str, float]] = {
+            folder: {} for folder in self.folders}
+        self.__full_pass: Dict[Path, float] = {}
+
+    def run(self, stop: Optional[Callable[[], bool]] = None) -> None:
+        """Watches until stop returns True or the process is interrupted."""
+        if not self.args_.quiet:
+            self.update_function(
+                f"Watching {len(self.folders)} folders using "
+                f"{'inotify' if isinstance(self.watcher, InotifyWatcher) else 'polling'}.")
+        tick = max(0.1, self.debounce / 2)
+        try:
+            while stop is None or not stop():
+                self.__queue(self.watcher.wait(tick))
+                self.__handle_due()
+        finally:
+            self.watcher.close()
+            self.context.close()
+
+    def __queue(self, changes: Changes) -> None:
+        now = time.monotonic()
+        for folder, names in changes.items():
+            pending = self.__pending[folder]
+            if names is None or folder in self.__full_pass:
+                self.__full_pass[folder] = now
+                pending.clear()
+                continue
+            for name in names:
+                pending[name] = now
+                if is_lock_name(name, name_suffixes(name)):
+                    pending[lock_owner_name(name)] = now
+            if len(pending) > MAX_PENDING:
+                self.__full_pass[folder] = now
+                pending.clear()
+
+    def __handle_due(self) -> None:
+        now = time.monotonic()
+        for folder in self.folders:
+            full_pass = self.__full_pass.get(folder)
+            if full_pass is not None:
+                if now - full_pass >= self.debounce:
+                    del self.__full_pass[folder]
+                    self.__handle(folder, None)
+                continue
+            pending = self.__pending[folder]
+            due = {name for name, changed in pending.items()
+                   if now - changed >= self.debounce}
+            if due:
+                for name in due:
+                    del pending[name]
+                self.__handle(folder, due)
+
+    def __handle(self, folder: Path, names: Optional[Set[str]]) -> None:
+        try:
+            snapshot = scan_folder(folder, names)
+        except OSError as exc:
+            if not self.args_.quiet:
+                self.update_function(f"Could not scan {folder}: {exc}")
+            return
+
+        settled: Set[str] = set()
+        now = time.time()
+        for entry in snapshot:
+            if names is not None and entry.name not in names:
+                continue
+            if (entry.stat is not None
+                    and now - entry.stat.st_mtime < self.debounce):
+                # Still being written, look at it again later.
+                self.__pending[folder][entry.name] = time.monotonic()
+                continue
+            settled.add(entry.name)
+        if not settled:
+            return
+
+        self.handled += self.executor.execute(plan_folder(
+            snapshot, self.rules, self.args_, only=settled,
+            duplicates=self.context.duplicates,
+            sniffer=self.context.sniffer))
+        self.failed += len(self.executor.errors)
+        if not self.args_.quiet:
+            for operation, exc in self.executor.errors:
+                self.update_function(describe_failure(operation, exc))
+        # Errors are reported per batch so a long watch does not pile them up.
+        self.executor.errors.clear()
@@ -0,0 +1,256 @@
+"""Differential test of Rules.classify against the original get_folder_name"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath("src")))
+
+from config import Config  # noqa: E402
+from scanner import scan_folder  # noqa: E402
+
+FILE_TYPES = {"pdf": "Documents", "txt": "Documents", "jpg": "Picture Media",
+              "tar": "Archives", "zip": "Archives/Compressed",
+              "gz": "Archives/Compressed", "sh": "Programming/Bash"}
+SPECIAL_FILE_TYPES = {"unknown-extension": "Misc", "no-extension": "Misc",
+                      "executable-no-extension": "Executables",
+                      "directories": "Folders", "symlinks": "Links",
+                      "extracted-archives": "Archives/Extracted"}
+STEMS = ["report", "a.b", "~report", ".hidden", "x", "photo", "backup",
+         "data", "v1.2", "lock"]
+SUFFIXES = ["", ".pdf", ".txt", ".jpg", ".tar", ".gz", ".tar.gz", ".zip",
+            ".lock", ".pdf.lock", "#", ".txt#", ".weird", ".sh"]
+FOLDERS = ["Documents", "Archives", "Compressed", "Misc", "Folders", "photo",
+           "backup", "data", "report", "stuff"]
+SEEDS = range(25)
+
+
+def old_get_folder_name(file: Path, files: List[Path], config: Config
+                        ) -> str:
+    """get_folder_name as it was before the rules were compiled."""
+    suffixes: List[str] = file.suffixes
+    folder_name: Optional[str] = None
+
+    if not os.access(file, os.W_OK) or not os.access(file, os.R_OK):
+        folder_name = "!ignore"
+    elif file.is_dir():
+        if file.name not in config.file_types_var.values() and "directories" in config.special_file_types:
+            folder_name = config.special_file_types["directories"]
+        else:
+            folder_name = "!ignore"
+    elif file.is_symlink():
+        if "symlinks" in config.special_file_types:
+            folder_name = config.special_file_types["symlinks"]
+        else:
+            for suffix in suffixes:
+                if suffix[1:] in config.file_types_var:
+                    folder_name = config.file_types_var[suffix[1:]]
+    elif suffixes and (
+            suffixes[-1].endswith("#") or
+            suffixes[-1][1:] == "lock" or
+            file.name.startswith("~")
+    ):
+
+        if ("handle-locked-files" in config.settings
+                and config.settings["handle-locked-files"]):
+            file_name = file.name
+            for substring in [".lock", "lock", "~", "#"]:
+                file_name = file_name.replace(substring, "")
+            for file_ in files:
+                if file_.name == file_name:
+                    files.remove(file_)
+                    folder_name = "!ignore"
+                    break
+        elif suffixes[-1][1:] == "lock":
+            suffixes.pop()
+
+    else:
+        file_name = file.name
+        if ("handle-locked-files" in config.settings
+                and config.settings["handle-locked-files"]):
+            for file_ in files:
+                if file_name in file_.name:
+                    files.remove(file_)
+                    folder_name = "!ignore"
+                    break
+
+        if "extracted-archives" in config.special_file_types and (
+                ".tar" in file.suffixes or
+                ".zip" in file.suffixes or
+                ".7z" in file.suffixes or
+                ".rar" in file.suffixes):
+            file_name = str(file)
+            for file_ in files:
+                if file_.is_dir() and file_name in file_.name:
+                    folder_name = \
+                        config.special_file_types["extracted-archives"]
+        if not folder_name:
+            for suffix in suffixes:
+                if suffix[1:] in config.file_types_var:
+                    folder_name = config.file_types_var[suffix[1:]]
+    if not folder_name and not suffixes \
+            and os.access(file, os.X_OK):
+        if "executable-no-extension" in config.special_file_types:
+            folder_name = config.special_file_types[
+                "executable-no-extension"]
+        elif "no-extension" in config.special_file_types:
+            folder_name = config.special_file_types["no-extension"]
+        else:
+            folder_name = config.special_file_types[
+                "unknown-extension"]
+    elif not folder_name and not suffixes:
+        folder_name = config.special_file_types["no-extension"]
+    if not folder_name:
+        folder_name = config.special_file_types["unknown-extension"]
+    return folder_name
+
+
+def generate_folder(folder: Path, seed: int) -> None:
+    """Fills folder with random files, directories, symlinks and
+    executables."""
+    generator = random.Random(seed)
+    for _ in range(generator.randint(5, 40)):
+        name = generator.choice(STEMS) + generator.choice(SUFFIXES)
+        path = folder.joinpath(name)
+        if os.path.lexists(path):
+            continue
+        path.touch()
+        if generator.random() < 0.15:
+            path.chmod(0o755)
+    for name in generator.sample(FOLDERS, generator.randint(0, 4)):
+        folder.joinpath(name).mkdir(exist_ok=True)
+    for name in generator.sample(["report.tar", "photo.zip", "data.tar.gz"],
+                                 generator.randint(0, 2)):
+        # An archive next to the folder it was extracted to.
+        extracted = folder.joinpath(name.split(".")[0])
+        if not os.path.lexists(extracted):
+            extracted.mkdir()
+        if not os.path.lexists(folder.joinpath(name)):
+            folder.joinpath(name).touch()
+    for name, target in (("link.pdf", "x"), ("link", "stuff"),
+                         ("broken.txt", "nowhere")):
+        if generator.random() < 0.3 and not os.path.lexists(
+                folder.joinpath(name)):
+            folder.joinpath(name).symlink_to(target)
+
+
+def write_config(path: Path, folder: Path, handle_locked_files: bool
+                 ) -> Config:
+    """Writes a config organizing folder and reads it."""
+    path.write_text(json.dumps({
+        "file-types": FILE_TYPES,
+        "folders-to-organize": [str(folder)],
+        "special-file-types": SPECIAL_FILE_TYPES,
+        "settings": {"handle-locked-files": handle_locked_files},
+    }), encoding="utf-8")
+    return Config(path)
+
+
+def classify_old(folder: Path, config: Config) -> Dict[str, str]:
+    """Folder names of the entries the original loop handled."""
+    folder_names: Dict[str, str] = {}
+    files = list(folder.iterdir())
+    while files:
+        file = files.pop(0)
+        folder_names[file.name] = old_get_folder_name(file, files, config)
+    return folder_names
+
+
+def classify_new(folder: Path, config: Config) -> Dict[str, str]:
+    """Folder names of the entries Rules.classify yields."""
+    args_ = argparse.Namespace(debug=False, quiet=True)
+    return {entry.name: folder_name for entry, folder_name
+            in config.compile_rules().classify(scan_folder(folder), args_)}
+
+
+def intended_difference(config: Config, path: Path, old: Optional[str],
+                        new: Optional[str]) -> bool:
+    """Whether the results differ on purpose:
+
+    * Directories named after any destination folder, including the top
+      folder of nested ones such as Archives for Archives/Compressed and
+      the special-file-types folders, are left alone. The original only
+      compared the name with the file-types values.
+    * Archives next to the folder they were extracted to go to
+      extracted-archives. The original compared the full path of the
+      archive with the folder names and never matched. Archives ignored
+      for a locked sibling stay ignored."""
+    rules = config.compile_rules()
+    if (path.is_dir() and path.name in rules.destinations
+            and old == rules.directories and new == "!ignore"):
+        return True
+    return (new == rules.extracted_archives and old != new
+            and old != "!ignore")
+
+
+class TestClassifyMatchesOriginal(unittest.TestCase):
+    """Rules.classify gives the folder names of the original
+    get_folder_name for generated folders."""
+
+    def check(self, handle_locked_files: bool) -> None:
+        for seed in SEEDS:
+            with self.subTest(seed=seed), \
+                    tempfile.TemporaryDirectory() as temp:
+                folder = Path(temp).joinpath("organize")
+                folder.mkdir()
+                generate_folder(folder, seed)
+                config = write_config(Path(temp).joinpath("config.json"),
+                                      folder, handle_locked_files)
+                old = classify_old(folder, config)
+                new = classify_new(folder, config)
+                for name in sorted(old.keys() | new.keys()):
+                    if old.get(name) == new.get(name):
+                        continue
+                    self.assertTrue(
+                        intended_difference(config, folder.joinpath(name),
+                                            old.get(name), new.get(name)),
+                        f"{name}: {old.get(name)} became {new.get(name)}")
+
+    def test_without_locked_files(self) -> None:
+        self.check(handle_locked_files=False)
+
+    def test_with_locked_files(self) -> None:
+        self.check(handle_locked_files=True)
+
+
+class TestIntendedDifferences(unittest.TestCase):
+    """The differences intended_difference allows do happen."""
+
+    def classify(self, names: List[str], directories: List[str],
+                 handle_locked_files: bool = False) -> Dict[str, str]:
+        with tempfile.TemporaryDirectory() as temp:
+            folder = Path(temp).joinpath("organize")
+            folder.mkdir()
+            for name in names:
+                folder.joinpath(name).touch()
+            for name in directories:
+                folder.joinpath(name).mkdir()
+            config = write_config(Path(temp).joinpath("config.json"),
+                                  folder, handle_locked_files)
+            return classify_new(folder, config)
+
+    def test_destination_directories_are_ignored(self) -> None:
+        folder_names = self.classify([], ["Archives", "Links", "stuff"])
+        self.assertEqual(folder_names, {"Archives": "!ignore",
+                                        "Links": "!ignore",
+                                        "stuff": "Folders"})
+
+    def test_extracted_archives(self) -> None:
+        folder_names = self.classify(["data.tar.gz", "other.zip"], ["data"])
+        self.assertEqual(folder_names["data.tar.gz"], "Archives/Extracted")
+        self.assertEqual(folder_names["other.zip"], "Archives/Compressed")
+
+    def test_locked_extracted_archive_stays_ignored(self) -> None:
+        folder_names = self.classify(["x.zip", "x.zip.part"], ["x"],
+                                     handle_locked_files=True)
+        self.assertEqual(folder_names["x.zip"], "!ignore")
+        self.assertNotIn("x.zip.part", folder_names)
+
+
+if __name__ == "__main__":
+    unittest.main()